@@ -0,0 +1,90 @@
+# Author: Kamil Kobak
+# License: GPL-3.0
+# Per-cycle cost of running every collector once, with the "shell" and the
+# "native" collector backends. CPU time includes the spawned commands.
+# Also the per-read cost of /proc files: open/read/decode/split every time
+# versus a persistent monitor.ProcFile parsed as bytes.
+# Usage: python3 benchmark.py [cycles]
+import os
+import sys
+import time
+
+import monitor
+
+def measure_backend(backend, cycles):
+    monitor.COLLECTOR_BACKEND = backend
+    commands = 0
+    run_command = monitor.run_command
+
+    def counting_run_command(argv):
+        nonlocal commands
+        commands += 1
+        return run_command(argv)
+
+    monitor.run_command = counting_run_command
+    try:
+        start_times = os.times()
+        start_wall = time.perf_counter()
+        for _ in range(cycles):
+            for _, collector in monitor.COLLECTORS:
+                collector()
+        wall = time.perf_counter() - start_wall
+        end_times = os.times()
+    finally:
+        monitor.run_command = run_command
+
+    cpu = sum(getattr(end_times, field) - getattr(start_times, field)
+              for field in ("user", "system", "children_user", "children_system"))
+    return {
+        "cpu_ms": cpu / cycles * 1000,
+        "wall_ms": wall / cycles * 1000,
+        "commands": commands / cycles
+    }
+
+def read_text_meminfo():
+    meminfo = {}
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            parts = line.split(':')
+            if len(parts) == 2:
+                meminfo[parts[0].strip()] = parts[1].strip()
+    return int(meminfo['MemTotal'].split()[0]), int(meminfo['MemAvailable'].split()[0])
+
+def read_procfile_meminfo(meminfo=monitor.ProcFile('/proc/meminfo', one_shot=True)):
+    meminfo.read()
+    return int(meminfo.field(b"MemTotal:")), int(meminfo.field(b"MemAvailable:"))
+
+def read_text_stat():
+    with open('/proc/stat', 'r') as f:
+        return [line.split() for line in f.read().splitlines() if line.startswith('cpu')]
+
+def read_procfile_stat(stat=monitor.ProcFile('/proc/stat', one_shot=True)):
+    stat.read()
+    return [line.split() for line in stat.content().splitlines() if line.startswith(b'cpu')]
+
+def measure_reads(read, reads):
+    start = time.perf_counter()
+    for _ in range(reads):
+        read()
+    return (time.perf_counter() - start) / reads * 1e6
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'backend':<8} {'cpu ms/cycle':>13} {'wall ms/cycle':>14} {'commands/cycle':>15}")
+    results = {}
+    for backend in ("shell", "native"):
+        results[backend] = measure_backend(backend, cycles)
+        r = results[backend]
+        print(f"{backend:<8} {r['cpu_ms']:>13.2f} {r['wall_ms']:>14.2f} {r['commands']:>15.1f}")
+    if results["native"]["cpu_ms"] > 0:
+        print(f"native backend uses {results['shell']['cpu_ms'] / results['native']['cpu_ms']:.1f}x less CPU per cycle")
+
+    reads = cycles * 500
+    print()
+    print(f"{'/proc read':<14} {'text us/read':>13} {'ProcFile us/read':>17}")
+    for name, text, procfile in (("/proc/meminfo", read_text_meminfo, read_procfile_meminfo),
+                                 ("/proc/stat", read_text_stat, read_procfile_stat)):
+        print(f"{name:<14} {measure_reads(text, reads):>13.2f} {measure_reads(procfile, reads):>17.2f}")
+
+if __name__ == "__main__":
+    main()
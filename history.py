@@ -0,0 +1,55 @@
+# Author: Kamil Kobak
+# License: GPL-3.0
+# Prints the history a running monitor keeps in its ring files, read through
+# read-only mappings of the same files: for every family, the store that
+# fits the range (raw samples or a rollup), summarised per metric.
+# Usage: python3 history.py [range seconds] [metric,...]
+import os
+import sys
+import time
+
+import monitor
+
+def open_stores(directory):
+    # Family -> read-only stores, finest resolution first
+    families = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".ring"):
+            family = name[:-len(".ring")].split("-", 1)[0]
+            families.setdefault(family, []).append(monitor.open_history_file(os.path.join(directory, name)))
+    return {family: sorted(stores, key=lambda s: s.interval) for family, stores in families.items()}
+
+def summarize(store, start, end, step, names):
+    # Metric -> (points, min, avg, max, last) over the range
+    series = {aggregate: store.query(start, end, step, names, aggregate)["series"]
+              for aggregate in ("min", "avg", "max", "last")}
+    summary = {}
+    for name in series["avg"]:
+        averages = [v for v in series["avg"][name] if v is not None]
+        if not averages:
+            summary[name] = (0, None, None, None, None)
+            continue
+        summary[name] = (
+            len(averages),
+            min(v for v in series["min"][name] if v is not None),
+            sum(averages) / len(averages),
+            max(v for v in series["max"][name] if v is not None),
+            [v for v in series["last"][name] if v is not None][-1],
+        )
+    return summary
+
+def main():
+    window = float(sys.argv[1]) if len(sys.argv) > 1 else 3600
+    names = sys.argv[2].split(",") if len(sys.argv) > 2 else None
+    end = time.time()
+    start = end - window
+    step = max(monitor.HISTORY_INTERVAL, window / monitor.HISTORY_MAX_POINTS)
+    print(f"{'metric':<40} {'resolution':>10} {'points':>7} {'min':>8} {'avg':>8} {'max':>8} {'last':>8}")
+    for family, stores in open_stores(monitor.HISTORY_DIR).items():
+        store = monitor.history_store(stores, start, step)
+        for name, (points, *values) in summarize(store, start, end, step, names).items():
+            cells = " ".join(f"{'--':>8}" if v is None else f"{v:>8.3f}" for v in values)
+            print(f"{name:<40} {store.interval:>9}s {points:>7} {cells}")
+
+if __name__ == "__main__":
+    main()
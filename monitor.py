@@ -1,117 +1,922 @@
 # Author: Kamil Kobak
 # License: GPL-3.0
 import os
+import re
+import math
+import struct
+import gzip
 import json
+import hashlib
 import time
+import shutil
+import asyncio
 import subprocess
+import signal
 import socket
+import mmap
+import threading
+import queue
+import heapq
+import bisect
+from array import array
+from urllib.parse import parse_qs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
 from datetime import datetime
+from operator import sub
+
+try:
+    import numpy  # Optional: vectorized per-core CPU deltas
+except ImportError:
+    numpy = None
 
 # --- CONFIGURATION ---
-REFRESH_INTERVAL = 5  # Refresh interval in seconds
+ENGINE = "threads"  # Collector runtime: "threads" (thread pool) or "asyncio" (event loop)
+COLLECTOR_BACKEND = "native"  # "native" (read /proc, utmp and statvfs in-process) or "shell" (df, who, uptime...)
+REFRESH_INTERVAL = 1  # Base loop tick in seconds (data.json is rewritten every tick)
+# Per-collector refresh interval in seconds; collectors not listed run every tick
+COLLECTOR_INTERVALS = {
+    "cpu": 1,
+    "memory": 1,
+    "load": 5,
+    "processes": 5,
+    "vmstat": 5,
+    "cgroup": 5,
+    "disk": 10,
+    "mounts": 10,
+    "users": 10,
+    "services": 10,
+    "docker_containers": 15,
+    "system": 30,
+    "ufw": 30,
+    "fail2ban": 60,
+}
+COLLECTOR_WORKERS = 8  # Max collectors running concurrently
+COLLECTOR_TIMEOUT = 3  # Hard deadline in seconds for a single collector run
+# Per-collector deadline overrides for the slow external commands
+COLLECTOR_TIMEOUTS = {
+    "docker_containers": 5,
+    "ufw": 10,
+    "fail2ban": 10,
+}
+COMMAND_TIMEOUT = 10  # External commands running longer than this are killed
 CHECK_SERVICES = ["docker", "libvirtd", "smbd"]  # Services to monitor
-DATA_FILE_PATH = "/opt/kkdash/www/data.json"  # Absolute path to save the data.json file
+DATA_FILE_PATH = "/opt/kkdash/www/data.json"  # Absolute path to save the data.json file (None to disable)
+DATA_FILE_GZIP = False  # Also write a precompressed data.json.gz (for nginx gzip_static)
+HTTP_SERVER = False  # Serve the dashboard and live data from memory, without nginx
+HTTP_HOST = "0.0.0.0"  # Address the built-in server listens on
+HTTP_PORT = 8080  # Port the built-in server listens on
+WWW_DIR = "/opt/kkdash/www"  # Directory with index.html and style.css for the built-in server
+SCHEMA_LEGACY_STRINGS = False  # Also emit the pre-v2 display strings ("5.0%", "31953 MB", "1.7G")
+SCHEMA_DISPLAY_HINTS = True  # Include unit/formatting hints for the raw v2 numbers
+CGROUP_MODE = "auto"  # Report a cgroup v2's usage against its limits: "off", "on", or "auto" (inside containers)
+CGROUP_PATH = None  # cgroup to report, relative to CGROUP_ROOT (None = the monitor's own cgroup)
+CGROUP_ROOT = "/sys/fs/cgroup"  # Mount point of the cgroup v2 hierarchy
+STATVFS_TIMEOUT = 2  # Seconds a filesystem may take to answer statvfs before it is reported unresponsive
+STATVFS_WORKERS = 4  # statvfs threads started up front; more are added while there are more mounts
+STATVFS_RETRY_MIN = 30  # First retry of an unresponsive filesystem, in seconds; doubles per failure
+STATVFS_RETRY_MAX = 900  # Longest wait between retries of an unresponsive filesystem
+TOP_PROCESSES = 10  # Processes listed by CPU and by memory
+PROCESS_SCAN_BUDGET = 0.1  # Seconds per cycle spent reading /proc/[pid]/stat; the rest waits for the next cycle
+CPU_SAMPLER_HZ = 0  # Sample CPU usage 10-50 times a second between ticks to catch short bursts (0 = off)
+CPU_SAMPLER_MAX_OVERHEAD = 0.005  # Share of one core the sampler may use before it lowers its rate
+HISTORY_DIR = "/opt/kkdash/history"  # Ring files with usage/security history (None keeps it in memory)
+HISTORY_RETENTION_DAYS = 14  # Days of raw samples kept in the ring files
+HISTORY_ROLLUPS = {60: 14, 300: 90, 3600: 730}  # Rollup resolution in seconds -> days kept
+HISTORY_INTERVAL = 5  # Seconds between stored usage samples
+HISTORY_MOUNT_SLOTS = 8  # Mounts tracked in the history
+HISTORY_SLOT_REUSE = 86400  # Seconds without samples after which a metric's column can go to a new metric
+HISTORY_MOUNT_INTERVAL = 60  # Seconds between stored filesystem usage samples
+HISTORY_MOUNT_ROLLUPS = {3600: 730}  # Rollups kept for filesystem usage, which changes slowly
+HISTORY_MAX_POINTS = 500  # Default number of points a /history response is downsampled to
+# ---------------------
+
+# --- COMMAND RUNTIME ---
+# Collectors that need external commands are generators: they yield a command
+# (argv list) and get its output back, or a tuple of commands that may run in
+# parallel and get a list of outputs (None for a failed command). A failing
+# single command raises inside the collector just like check_output would.
+# The same collector body therefore runs on both the blocking and asyncio engines.
+
+def run_command(argv):
+    result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=COMMAND_TIMEOUT)
+    output = result.stdout.decode()
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, argv, output=output)
+    return output
+
+async def run_command_async(argv):
+    proc = await asyncio.create_subprocess_exec(*argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), COMMAND_TIMEOUT)
+    except BaseException:
+        # Timed out or the collector was cancelled at its deadline
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    output = stdout.decode()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, argv, output=output)
+    return output
+
+def _drive(gen, send, throw):
+    # One step of a command collector: feed back a reply or an error
+    try:
+        return (gen.throw(throw) if throw is not None else gen.send(send)), None
+    except StopIteration as stop:
+        return None, stop
+
+def command_collector(func):
+    # Turn a command generator into a blocking collector with an asyncio variant
+    def run():
+        gen = func()
+        reply, error = None, None
+        while True:
+            request, stop = _drive(gen, reply, error)
+            if stop is not None:
+                return stop.value
+            reply, error = None, None
+            if isinstance(request, tuple):
+                reply = []
+                for argv in request:
+                    try:
+                        reply.append(run_command(argv))
+                    except Exception:
+                        reply.append(None)
+            else:
+                try:
+                    reply = run_command(request)
+                except Exception as e:
+                    error = e
+
+    async def run_async():
+        gen = func()
+        reply, error = None, None
+        while True:
+            request, stop = _drive(gen, reply, error)
+            if stop is not None:
+                return stop.value
+            reply, error = None, None
+            if isinstance(request, tuple):
+                results = await asyncio.gather(*(run_command_async(argv) for argv in request), return_exceptions=True)
+                reply = [None if isinstance(r, BaseException) else r for r in results]
+            else:
+                try:
+                    reply = await run_command_async(request)
+                except Exception as e:
+                    error = e
+
+    run.__name__ = func.__name__
+    run.run_async = run_async
+    return run
+# ---------------------
+
+# --- NATIVE READERS ---
+# In-process replacements for the df, who, uptime, uname, grep and nproc calls
+# used by the "shell" backend.
+
+class ProcFile:
+    # A /proc file kept open and re-read with preadv from offset 0 into a
+    # preallocated buffer (the kernel regenerates the content on every read),
+    # so a read costs no open/close or decode. Most /proc files are printed a
+    # record at a time and a single read returns about one page however big
+    # the buffer is, so they are read at increasing offsets until EOF; files
+    # the kernel prints in one piece (one_shot) take a single read. The buffer
+    # doubles whenever the content fills it. Not thread-safe: every file has
+    # a single reader (see proc_file).
+    def __init__(self, path, size=4096, one_shot=False):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(size)
+        self.one_shot = one_shot
+        self.length = 0
+        # Offset of each looked-up key in the previous read; /proc key/value
+        # files print fixed-width columns, so these rarely move
+        self.offsets = {}
+
+    def read(self):
+        if self.one_shot:
+            while True:
+                self.length = os.preadv(self.fd, [self.buffer], 0)
+                if self.length < len(self.buffer):
+                    return self.length
+                self.buffer = bytearray(len(self.buffer) * 2)
+        length = 0
+        while True:
+            if length == len(self.buffer):
+                buffer = bytearray(len(self.buffer) * 2)
+                buffer[:length] = self.buffer
+                self.buffer = buffer
+            with memoryview(self.buffer) as view:
+                count = os.preadv(self.fd, [view[length:]], length)
+            if count == 0:
+                self.length = length
+                return length
+            length += count
+
+    def content(self):
+        # Copy of the last read, for files that are parsed whole
+        return bytes(memoryview(self.buffer)[:self.length])
+
+    def _at(self, key, offset):
+        # Whether key starts a line at offset and is followed by a separator
+        end = offset + len(key)
+        return (offset >= 0 and end < self.length and self.buffer.startswith(key, offset)
+                and (offset == 0 or self.buffer[offset - 1] == 10)
+                and (key[-1] in b": \t" or self.buffer[end] in b" \t"))
+
+    def _value(self, key):
+        # (start, end) of the first token after a line-leading key in the last
+        # read, found in place, or None when the key is missing
+        buffer, length = self.buffer, self.length
+        offset = self.offsets.get(key, -1)
+        if not self._at(key, offset):
+            offset = buffer.find(key, 0, length)
+            while offset >= 0 and not self._at(key, offset):
+                offset = buffer.find(key, offset + 1, length)
+            if offset < 0:
+                return None
+            self.offsets[key] = offset
+        start = offset + len(key)
+        # Skip the padding, then cut at the next space or newline
+        while start < length and (buffer[start] == 32 or buffer[start] == 9):
+            start += 1
+        end = start
+        while end < length and buffer[end] not in b" \t\n":
+            end += 1
+        return start, end
+
+    def field(self, key):
+        # First token after a line-leading key (e.g. b"MemTotal:") in the last
+        # read, or None when the key is missing
+        span = self._value(key)
+        return None if span is None else bytes(self.buffer[span[0]:span[1]])
+
+    def scan(self, index, values):
+        # values[slot] = int(value) for every key in index (key -> slot) in
+        # the "key value ..." lines of the last read, None when missing; only
+        # the wanted values are copied out of the buffer
+        buffer = self.buffer
+        for key, slot in index.items():
+            span = self._value(key)
+            values[slot] = None if span is None else int(buffer[span[0]:span[1]])
+        return values
+
+# One ProcFile per path, opened on first use
+proc_files = {}
+
+def proc_file(path, size=4096, one_shot=False):
+    file = proc_files.get(path)
+    if file is None:
+        file = proc_files[path] = ProcFile(path, size, one_shot)
+    return file
+
+def read_proc(path, one_shot=False):
+    file = proc_file(path, one_shot=one_shot)
+    file.read()
+    return file.content()
+
+# Filesystem types hidden from the filesystem table: pseudo filesystems (df
+# hides these by default) plus the ones excluded with df -x
+EXCLUDED_FSTYPES = {
+    "tmpfs", "devtmpfs", "overlay",
+    "proc", "sysfs", "devpts", "cgroup", "cgroup2", "securityfs", "debugfs", "tracefs",
+    "pstore", "bpf", "mqueue", "hugetlbfs", "configfs", "fusectl", "autofs", "binfmt_misc",
+    "rpc_pipefs", "nsfs", "efivarfs", "selinuxfs", "ramfs",
+}
+
+UTMP_PATH = "/var/run/utmp"
+UTMP_RECORD = struct.Struct("<h2xi32s4s32s256shhiii4i20s")  # struct utmp on Linux (384 bytes)
+UTMP_USER_PROCESS = 7
+
+def read_cpu_model():
+    fallback = ""
+    with open('/proc/cpuinfo', 'r') as f:
+        for line in f:
+            if line.startswith('model name'):
+                return line.split(':', 1)[1].strip()
+            # Some ARM systems use 'Processor' instead of 'model name'
+            if not fallback and line.startswith('Processor'):
+                fallback = line.split(':', 1)[1].strip()
+    return fallback
+
+def read_cpu_count():
+    # Same as nproc: CPUs this process may run on
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+def human_size(num):
+    # Same rounding as df -h: powers of 1024, rounded up, one decimal below 10
+    units = ["", "K", "M", "G", "T", "P", "E"]
+    value = float(num)
+    index = 0
+    while value >= 1024 and index < len(units) - 1:
+        value /= 1024
+        index += 1
+    if index == 0:
+        return str(int(num))
+    if value < 10:
+        value = math.ceil(value * 10) / 10
+        if value < 10:
+            return f"{value:.1f}{units[index]}"
+    value = math.ceil(value)
+    if value >= 1024 and index < len(units) - 1:
+        return f"1.0{units[index + 1]}"
+    return f"{value:.0f}{units[index]}"
+
+def statvfs_usage(path):
+    # Size, used and available bytes of a filesystem as df reports them
+    st = os.statvfs(path)
+    size = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    avail = st.f_bavail * st.f_frsize
+    return size, used, avail
+
+def _unescape_mount_path(path):
+    # mountinfo escapes space, tab, newline and backslash as octal
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), path)
+
+def read_mounts():
+    # Real mounts from /proc/self/mountinfo as (source, target, fstype), one per device
+    mounts = []
+    by_device = {}
+    for line in read_proc('/proc/self/mountinfo').decode(errors='replace').splitlines():
+        fields = line.split()
+        try:
+            sep = fields.index('-')
+        except ValueError:
+            continue
+        device = fields[2]
+        target = _unescape_mount_path(fields[4])
+        fstype, source = fields[sep + 1], _unescape_mount_path(fields[sep + 2])
+        if fstype in EXCLUDED_FSTYPES:
+            continue
+        # Bind mounts repeat a device, keep the shortest mount point like df
+        if device in by_device:
+            index = by_device[device]
+            if len(target) < len(mounts[index][1]):
+                mounts[index] = (source, target, fstype)
+            continue
+        by_device[device] = len(mounts)
+        mounts.append((source, target, fstype))
+    return mounts
+
+class StatvfsWatchdog:
+    # statvfs on worker threads, so a hung NFS/CIFS mount (a call stuck in
+    # uninterruptible sleep) can't block the caller. Every mount gets a free
+    # worker and its own timeout, counted from when the worker picks it up. A
+    # call that doesn't return in time gets its worker written off (the stuck
+    # thread retires if the call ever returns) and the mount quarantined:
+    # reported unresponsive without being touched, retried after an
+    # exponentially growing backoff, and never probed again while its stuck
+    # call is still outstanding.
+    def __init__(self, workers, timeout):
+        self.timeout = timeout
+        self.requests = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.calls = threading.Lock()  # one stat() at a time
+        self.workers = 0  # live threads that are not stuck
+        self.quarantine = {}  # path -> (monotonic retry time, backoff seconds)
+        self.stuck = set()  # paths with a statvfs call that has not returned
+        self.last = {}  # path -> last (size, used, avail)
+        self._spawn(workers)
+
+    def _spawn(self, count):
+        for _ in range(count):
+            threading.Thread(target=self._work, name="statvfs", daemon=True).start()
+            self.workers += 1
+
+    def _work(self):
+        while True:
+            request = self.requests.get()
+            with self.lock:
+                if request["abandoned"]:
+                    continue  # given up on before it started
+                request["started"] = time.monotonic()
+            request["picked"].set()
+            try:
+                request["result"] = statvfs_usage(request["path"])
+            except OSError as e:
+                request["result"] = e
+            with self.lock:
+                request["done"].set()
+                if request["abandoned"]:
+                    # Replaced while stuck, the pool has its full size again
+                    self.stuck.discard(request["path"])
+                    return
+
+    def _backoff(self, path, now):
+        backoff = min(max(self.quarantine.get(path, (0, 0))[1] * 2, STATVFS_RETRY_MIN), STATVFS_RETRY_MAX)
+        self.quarantine[path] = (now + backoff, backoff)
+
+    def stat(self, paths):
+        # {path: (size, used, avail), an OSError, or None when unresponsive}
+        with self.calls:
+            now = time.monotonic()
+            results = {}
+            pending = []
+            for path in paths:
+                if path in self.quarantine and (now < self.quarantine[path][0] or path in self.stuck):
+                    if now >= self.quarantine[path][0]:
+                        self._backoff(path, now)  # due, but the last call is still stuck
+                    results[path] = None
+                    continue
+                pending.append({"path": path, "picked": threading.Event(), "done": threading.Event(),
+                                "started": None, "abandoned": False, "result": None})
+            # Workers are idle between calls, so this leaves one per mount
+            self._spawn(len(pending) - self.workers)
+            for request in pending:
+                self.requests.put(request)
+
+            for request in pending:
+                path = request["path"]
+                if request["picked"].wait(self.timeout):
+                    request["done"].wait(max(0.0, request["started"] + self.timeout - time.monotonic()))
+                with self.lock:
+                    if not request["done"].is_set():
+                        request["abandoned"] = True
+                        if request["started"] is not None:
+                            self.stuck.add(path)
+                            self.workers -= 1
+                if request["done"].is_set():
+                    results[path] = request["result"]
+                    self.quarantine.pop(path, None)
+                    if not isinstance(request["result"], OSError):
+                        self.last[path] = request["result"]
+                elif request["started"] is not None:
+                    self._backoff(path, time.monotonic())
+                    print(f"Filesystem {path} did not answer statvfs within {self.timeout}s, "
+                          f"retrying in {self.quarantine[path][1]}s")
+                    results[path] = None
+                else:
+                    # No worker got to it (threads could not be started):
+                    # no verdict this time, keep the last known usage
+                    results[path] = self.last.get(path)
+            return results
+
+statvfs_watchdog = None
+
+def statvfs_all(paths):
+    global statvfs_watchdog
+    if statvfs_watchdog is None:
+        statvfs_watchdog = StatvfsWatchdog(STATVFS_WORKERS, STATVFS_TIMEOUT)
+    return statvfs_watchdog.stat(paths)
+
+# Filesystem scan shared by the disk and mounts collectors: (monotonic time,
+# [(source, target, fstype, size, used, avail)]); sizes are None for a
+# filesystem that does not answer
+filesystem_scan = None
+filesystem_lock = threading.Lock()
+
+def scan_filesystems():
+    # One mountinfo pass and one statvfs per real mount; a scan younger than
+    # half the disk/mounts interval is reused, so both collectors running in
+    # the same cycle stat every filesystem once
+    global filesystem_scan
+    with filesystem_lock:
+        now = time.monotonic()
+        max_age = min(COLLECTOR_INTERVALS.get("disk", 0), COLLECTOR_INTERVALS.get("mounts", 0)) / 2
+        if filesystem_scan is not None and now - filesystem_scan[0] < max_age:
+            return filesystem_scan[1]
+        filesystems = []
+        mounts = read_mounts()
+        usage = statvfs_all([target for _, target, _ in mounts])
+        for source, target, fstype in mounts:
+            result = usage[target]
+            if isinstance(result, OSError):
+                continue
+            size, used, avail = result if result is not None else (None, None, None)
+            # df hides filesystems without blocks
+            if size == 0:
+                continue
+            filesystems.append((source, target, fstype, size, used, avail))
+        filesystem_scan = (now, filesystems)
+        return filesystems
+
+def read_logged_users():
+    users = set()
+    try:
+        with open(UTMP_PATH, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    for offset in range(0, len(data) - UTMP_RECORD.size + 1, UTMP_RECORD.size):
+        record = UTMP_RECORD.unpack_from(data, offset)
+        if record[0] == UTMP_USER_PROCESS:
+            name = record[4].split(b'\0', 1)[0].decode(errors='replace')
+            if name:
+                users.add(name)
+    return sorted(users)
+
+def format_uptime(seconds):
+    # Same wording as uptime -p
+    minutes = int(seconds) // 60
+    parts = []
+    for name, size in (("week", 10080), ("day", 1440), ("hour", 60), ("minute", 1)):
+        count, minutes = divmod(minutes, size)
+        if count:
+            parts.append(f"{count} {name}{'s' if count != 1 else ''}")
+    return "up " + (", ".join(parts) if parts else "0 minutes")
+
+def read_uptime():
+    return float(read_proc('/proc/uptime', one_shot=True).split(None, 1)[0])
+
+def read_os_name():
+    with open('/etc/os-release', 'r') as f:
+        for line in f:
+            if line.startswith('PRETTY_NAME='):
+                return line.split('=', 1)[1].strip().replace('"', '')
+    return "N/A"
+# ---------------------
+
+# --- HOST FACTS ---
+# CPU model, core count, kernel, OS name and hostname only change on reboot,
+# CPU hotplug or upgrade, so they are read once and re-read only when
+# /sys/devices/system/cpu/online or the /etc/os-release mtime changes, or on
+# SIGHUP. facts_version in the snapshot tells clients when to refresh them.
+CPU_ONLINE_PATH = "/sys/devices/system/cpu/online"
+OS_RELEASE_PATH = "/etc/os-release"
+
+host_facts = None
+host_facts_version = 0
+host_facts_stamp = None
+host_facts_reload = False
+host_facts_lock = threading.Lock()
+
+def _host_facts_stamp():
+    try:
+        with open(CPU_ONLINE_PATH, 'r') as f:
+            online = f.read().strip()
+    except OSError:
+        online = None
+    try:
+        os_release_mtime = os.stat(OS_RELEASE_PATH).st_mtime_ns
+    except OSError:
+        os_release_mtime = None
+    return online, os_release_mtime
+
+def read_host_facts():
+    facts = {"model": "N/A", "cores": "N/A", "kernel": "N/A", "os": "N/A", "hostname": "N/A"}
+    try:
+        facts["model"] = read_cpu_model()
+        facts["cores"] = str(read_cpu_count())
+    except Exception:
+        pass
+    try:
+        facts["os"] = read_os_name()
+    except Exception:
+        pass
+    facts["kernel"] = os.uname().release
+    facts["hostname"] = socket.gethostname()
+    return facts
+
+def get_host_facts():
+    global host_facts, host_facts_version, host_facts_stamp, host_facts_reload
+    with host_facts_lock:
+        stamp = _host_facts_stamp()
+        if host_facts is None or host_facts_reload or stamp != host_facts_stamp:
+            host_facts = read_host_facts()
+            host_facts_version += 1
+            host_facts_stamp = stamp
+            host_facts_reload = False
+        return host_facts
+
+def reload_host_facts(signum=None, frame=None):
+    # SIGHUP handler: re-read host facts on the next collection
+    global host_facts_reload
+    host_facts_reload = True
+# ---------------------
+
+# --- SNAPSHOT SCHEMA ---
+# Schema v2: metrics are raw numbers in base units, named by suffix (_bytes,
+# _ratio in 0..1, _seconds). Formatting is left to the client; the v1 display
+# strings listed in LEGACY_FIELDS are only kept with SCHEMA_LEGACY_STRINGS.
+SCHEMA_VERSION = 2
+DISPLAY_HINTS = {
+    "_bytes": {"unit": "B", "base": 1024},
+    "_ratio": {"unit": "%", "scale": 100, "decimals": 1},
+    "_seconds": {"unit": "s"},
+    "_per_second": {"unit": "/s"},
+}
+LEGACY_FIELDS = {
+    "cpu": ("usage", "cores"),
+    "memory": ("total", "used", "percent"),
+    "disk": ("total", "used", "free", "percent"),
+    "mounts": ("size", "used", "avail", "percent"),
+    "system": ("uptime",),
+}
+
+def ratio(part, whole):
+    return round(part / whole, 4) if whole else 0.0
+
+def df_percent(used, avail):
+    # Use% as df prints it: rounded up, relative to space available to users
+    return f"{math.ceil(used * 100 / (used + avail))}%" if used + avail > 0 else "-"
+
+def filesystem_usage(size, used, avail):
+    # Typed usage of a filesystem plus its v1 display strings
+    return {
+        "size_bytes": size,
+        "used_bytes": used,
+        "avail_bytes": avail,
+        "used_ratio": ratio(used, used + avail),
+        "size": human_size(size),
+        "used": human_size(used),
+        "avail": human_size(avail),
+        "percent": df_percent(used, avail)
+    }
+
+# Usage fields of a filesystem that did not answer statvfs in time
+UNRESPONSIVE_FILESYSTEM = {
+    "size_bytes": None, "used_bytes": None, "avail_bytes": None, "used_ratio": None,
+    "size": "-", "used": "-", "avail": "-", "percent": "-",
+}
+
+def strip_legacy_fields(key, value):
+    fields = LEGACY_FIELDS.get(key)
+    if not fields or SCHEMA_LEGACY_STRINGS:
+        return value
+    if isinstance(value, list):
+        return [{k: v for k, v in item.items() if k not in fields} for item in value]
+    if isinstance(value, dict):
+        return {k: v for k, v in value.items() if k not in fields}
+    return value
 # ---------------------
 
+# /proc/stat time columns of the "cpu" lines; guest and guest_nice are
+# already included in user and nice
+CPU_TIME_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
+
 # Global state for CPU calculation
 prev_cpu_times = None
+prev_core_times = None
+
+def core_times(lines):
+    # Busy+idle and idle jiffies (idle + iowait) of every cpuN line as whole
+    # arrays; guest time is already part of user, so only the first 8 fields count
+    rows = [line.split()[1:9] for line in lines]
+    if numpy is not None:
+        times = numpy.array(rows, dtype=numpy.float64)
+        return times.sum(axis=1), times[:, 3] + times[:, 4]
+    return (array('d', [sum(map(float, row)) for row in rows]),
+            array('d', [float(row[3]) + float(row[4]) for row in rows]))
+
+def core_usage_ratios(prev, current):
+    (prev_total, prev_idle), (total, idle) = prev, current
+    if numpy is not None:
+        total_delta = total - prev_total
+        busy_delta = total_delta - (idle - prev_idle)
+        ratios = numpy.divide(busy_delta, total_delta, out=numpy.zeros_like(total_delta), where=total_delta > 0)
+        return ratios.clip(0.0, 1.0).round(4).tolist()
+    return [round(max(0.0, min(1.0, (t - i) / t)), 4) if t > 0 else 0.0
+            for t, i in zip(map(sub, total, prev_total), map(sub, idle, prev_idle))]
+
+class CpuSampler:
+    # Background thread reading the aggregate cpu line of /proc/stat through a
+    # persistent fd at up to CPU_SAMPLER_HZ, so bursts shorter than a tick show
+    # up as min/mean/p95/max between two collections. Its own CPU time
+    # (thread_time) is measured every second; the rate is halved while that
+    # exceeds max_overhead of one core and doubled back once well below it.
+    # Note the kernel accounts CPU time in jiffies (usually 1/100 s), which
+    # limits the resolution of a single sample at high rates.
+    def __init__(self, hz, max_overhead):
+        self.target_hz = hz
+        self.hz = hz
+        self.max_overhead = max_overhead
+        self.overhead = 0.0
+        self.samples = array('d')
+        self.lock = threading.Lock()
+        self.fd = os.open('/proc/stat', os.O_RDONLY)
+        self.buffer = bytearray(256)  # the aggregate cpu line comes first
+
+    def start(self):
+        threading.Thread(target=self.run, name="cpu-sampler", daemon=True).start()
+
+    def read_times(self):
+        # (busy + idle, idle + iowait) jiffies of the aggregate cpu line
+        length = os.preadv(self.fd, [self.buffer], 0)
+        parts = self.buffer[:self.buffer.find(b"\n", 0, length)].split()[1:9]
+        total = sum(map(int, parts))
+        return total, int(parts[3]) + int(parts[4])
+
+    def run(self):
+        prev_total, prev_idle = self.read_times()
+        next_sample = time.monotonic()
+        window_start, window_cpu = next_sample, time.thread_time()
+        while True:
+            next_sample += 1 / self.hz
+            now = time.monotonic()
+            if next_sample > now:
+                time.sleep(next_sample - now)
+            else:
+                next_sample = now  # fell behind; don't burst to catch up
+            total, idle = self.read_times()
+            total_delta = total - prev_total
+            if total_delta > 0:
+                usage = max(0.0, min(1.0, (total_delta - (idle - prev_idle)) / total_delta))
+                with self.lock:
+                    self.samples.append(usage)
+                prev_total, prev_idle = total, idle
+
+            now = time.monotonic()
+            if now - window_start >= 1.0:
+                cpu = time.thread_time()
+                self.overhead = (cpu - window_cpu) / (now - window_start)
+                if self.overhead > self.max_overhead and self.hz > 1:
+                    self.hz = max(1, self.hz // 2)
+                elif self.overhead < self.max_overhead / 4 and self.hz < self.target_hz:
+                    self.hz = min(self.target_hz, self.hz * 2)
+                window_start, window_cpu = now, cpu
+
+    def drain(self):
+        # Statistics of the samples taken since the previous call
+        with self.lock:
+            samples = sorted(self.samples)
+            del self.samples[:]
+        stats = {"hz": self.hz, "samples": len(samples), "overhead_ratio": round(self.overhead, 5),
+                 "min_ratio": None, "mean_ratio": None, "p95_ratio": None, "max_ratio": None}
+        if samples:
+            stats.update({
+                "min_ratio": round(samples[0], 4),
+                "mean_ratio": round(sum(samples) / len(samples), 4),
+                "p95_ratio": round(samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)], 4),
+                "max_ratio": round(samples[-1], 4),
+            })
+        return stats
+
+cpu_sampler = None
 
+def start_cpu_sampler():
+    global cpu_sampler
+    try:
+        sampler = CpuSampler(CPU_SAMPLER_HZ, CPU_SAMPLER_MAX_OVERHEAD)
+        sampler.start()
+        cpu_sampler = sampler
+    except OSError as e:
+        print(f"Error starting CPU sampler: {e}")
+
+@command_collector
 def get_cpu_info():
-    global prev_cpu_times
+    global prev_cpu_times, prev_core_times
     try:
-        # Read /proc/stat
-        with open('/proc/stat', 'r') as f:
-            line = f.readline()
-        
-        if not line.startswith('cpu '):
-            return {"usage": "N/A", "model": "Error reading /proc/stat", "cores": "N/A"}
-        
-        # Parse CPU times: user, nice, system, idle, iowait, irq, softirq, steal, guest, guest_nice
+        # Read /proc/stat: the aggregate "cpu " line and one cpuN line per core
+        lines = read_proc('/proc/stat', one_shot=True).splitlines()
+        line = lines[0] if lines else b""
+
+        if not line.startswith(b'cpu '):
+            return {"usage_ratio": None, "usage": "N/A", "model": "Error reading /proc/stat",
+                    "core_count": None, "cores": "N/A", "core_usage_ratio": [], "breakdown": None,
+                    "context_switches_per_second": None, "interrupts_per_second": None, "sampler": None}
+
+        # Parse CPU times (CPU_TIME_FIELDS) plus the context switch and
+        # interrupt counters that follow the per-core lines
         parts = [float(x) for x in line.split()[1:]]
-        idle_time = parts[3] + parts[4]  # idle + iowait
-        non_idle_time = parts[0] + parts[1] + parts[2] + parts[5] + parts[6] + parts[7]
-        total_time = idle_time + non_idle_time
-        
-        usage = "0.0%"
+        parts += [0.0] * (len(CPU_TIME_FIELDS) - len(parts))
+        counters = {}
+        for extra in lines[1:]:
+            if extra.startswith((b'ctxt ', b'intr ')):
+                counters[extra[:4].decode()] = int(extra.split(None, 2)[1])
+        now = time.monotonic()
+
+        # No ratios until there is a previous sample to diff against
+        usage_ratio = None
+        breakdown = {f"{field}_ratio": None for field in CPU_TIME_FIELDS[:9]}
+        rates = {"ctxt": None, "intr": None}
         if prev_cpu_times is not None:
-            prev_total, prev_idle = prev_cpu_times
-            total_delta = total_time - prev_total
-            idle_delta = idle_time - prev_idle
-            
+            prev_parts, prev_counters, prev_time = prev_cpu_times
+            deltas = [max(0.0, a - b) for a, b in zip(parts, prev_parts)]
+            total_delta = sum(deltas[:8])
             if total_delta > 0:
-                usage_pct = (total_delta - idle_delta) / total_delta * 100
-                usage = f"{max(0, min(100, usage_pct)):.1f}%"
-        
-        prev_cpu_times = (total_time, idle_time)
-        
+                idle_delta = deltas[3] + deltas[4]  # idle + iowait
+                usage_ratio = round(max(0.0, min(1.0, (total_delta - idle_delta) / total_delta)), 4)
+                for field, delta in zip(CPU_TIME_FIELDS[:9], deltas):
+                    breakdown[f"{field}_ratio"] = round(delta / total_delta, 4)
+            elapsed = now - prev_time
+            for key in rates:
+                if elapsed > 0 and key in counters and key in prev_counters:
+                    rates[key] = round(max(0, counters[key] - prev_counters[key]) / elapsed, 1)
+        usage = f"{usage_ratio * 100:.1f}%" if usage_ratio is not None else "N/A"
+
+        prev_cpu_times = (parts, counters, now)
+        sampler = cpu_sampler.drain() if cpu_sampler is not None else None
+
+        current_core_times = core_times([l for l in lines[1:] if l.startswith(b'cpu')])
+        core_usage = []
+        # A changed core count (hotplug) restarts the per-core deltas
+        if prev_core_times is not None and len(prev_core_times[0]) == len(current_core_times[0]):
+            core_usage = core_usage_ratios(prev_core_times, current_core_times)
+        prev_core_times = current_core_times
+
         # Get CPU model and core count
-        model = subprocess.check_output("grep -m 1 'model name' /proc/cpuinfo | cut -d: -f1,2 --complement", shell=True).decode().strip()
+        if COLLECTOR_BACKEND == "native":
+            facts = get_host_facts()
+            return {
+                "usage_ratio": usage_ratio,
+                "usage": usage,
+                "model": facts["model"],
+                "core_count": int(facts["cores"]) if facts["cores"].isdigit() else None,
+                "cores": facts["cores"],
+                "core_usage_ratio": core_usage,
+                "breakdown": breakdown,
+                "context_switches_per_second": rates["ctxt"],
+                "interrupts_per_second": rates["intr"],
+                "sampler": sampler
+            }
+
+        model = ""
+        try:
+            line = yield ["grep", "-m", "1", "model name", "/proc/cpuinfo"]
+            model = line.split(':', 1)[1].strip()
+        except subprocess.CalledProcessError:
+            pass
         if not model: # Some ARM systems use 'Processor' instead of 'model name'
-             model = subprocess.check_output("grep -m 1 'Processor' /proc/cpuinfo | cut -d: -f2", shell=True).decode().strip()
-             
-        cores = subprocess.check_output("nproc", shell=True).decode().strip()
-        
+            line = yield ["grep", "-m", "1", "Processor", "/proc/cpuinfo"]
+            model = line.split(':', 1)[1].strip()
+
+        cores = (yield ["nproc"]).strip()
+
         return {
+            "usage_ratio": usage_ratio,
             "usage": usage,
             "model": model,
-            "cores": cores
+            "core_count": int(cores) if cores.isdigit() else None,
+            "cores": cores,
+            "core_usage_ratio": core_usage,
+            "breakdown": breakdown,
+            "context_switches_per_second": rates["ctxt"],
+            "interrupts_per_second": rates["intr"],
+            "sampler": sampler
         }
     except Exception as e:
-        return {"usage": "N/A", "model": str(e), "cores": "N/A"}
+        return {"usage_ratio": None, "usage": "N/A", "model": str(e), "core_count": None, "cores": "N/A",
+                "core_usage_ratio": [], "breakdown": None, "context_switches_per_second": None,
+                "interrupts_per_second": None, "sampler": None}
 
+@command_collector
 def get_mount_info():
     try:
-        # Get list of mounted filesystems (filtering for real disks and excluding overlay)
-        cmd = "df -h --output=source,size,used,avail,pcent,target -x tmpfs -x devtmpfs -x overlay | tail -n +2"
-        output = subprocess.check_output(cmd, shell=True).decode().splitlines()
+        if COLLECTOR_BACKEND == "native":
+            return [{"source": source, "target": target, "fstype": fstype, "status": "ok",
+                     **filesystem_usage(size, used, avail)} if size is not None else
+                    {"source": source, "target": target, "fstype": fstype, "status": "unresponsive",
+                     **UNRESPONSIVE_FILESYSTEM}
+                    for source, target, fstype, size, used, avail in scan_filesystems()]
+
+        # Get list of mounted filesystems (filtering for real disks and excluding overlay), in bytes
+        output = yield ["df", "-B1", "--output=source,fstype,size,used,avail,target",
+                        "-x", "tmpfs", "-x", "devtmpfs", "-x", "overlay"]
         mounts = []
-        for line in output:
-            parts = line.split()
-            if len(parts) >= 6:
-                mounts.append({
-                    "source": parts[0],
-                    "size": parts[1],
-                    "used": parts[2],
-                    "avail": parts[3],
-                    "percent": parts[4],
-                    "target": parts[5]
-                })
+        for line in output.splitlines()[1:]:
+            parts = line.split(None, 5)
+            if len(parts) == 6:
+                usage = filesystem_usage(int(parts[2]), int(parts[3]), int(parts[4]))
+                mounts.append({"source": parts[0], "target": parts[5], "fstype": parts[1], **usage})
         return mounts
     except Exception:
         return []
 
+@command_collector
 def get_logged_users():
     try:
-        cmd = "who | awk '{print $1}' | sort | uniq | tr '\\n' ' '"
-        users = subprocess.check_output(cmd, shell=True).decode().strip().split()
-        return users
+        if COLLECTOR_BACKEND == "native":
+            return read_logged_users()
+        output = yield ["who"]
+        # Unique login names, first column of who
+        return sorted({line.split()[0] for line in output.splitlines() if line.strip()})
     except Exception:
         return []
 
+@command_collector
 def get_service_status():
-    status_map = {}
-    for svc in CHECK_SERVICES:
-        try:
-            cmd = f"systemctl is-active {svc}"
-            status = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT).decode().strip()
-            status_map[svc] = status
-        except subprocess.CalledProcessError as e:
-            status_map[svc] = e.output.decode().strip() if e.output else "inactive"
-        except Exception:
-            status_map[svc] = "unknown"
-    return status_map
+    if not CHECK_SERVICES:
+        return {}
+    # One systemctl call answers for all units, one status line per unit
+    try:
+        output = yield ["systemctl", "is-active", *CHECK_SERVICES]
+    except subprocess.CalledProcessError as e:
+        # Non-zero exit just means at least one unit is not active
+        output = e.output
+    except Exception:
+        output = ""
+    lines = output.splitlines()
+    if len(lines) != len(CHECK_SERVICES):
+        return {svc: "unknown" for svc in CHECK_SERVICES}
+    return {svc: (status.strip() or "inactive") for svc, status in zip(CHECK_SERVICES, lines)}
 
+@command_collector
 def get_docker_containers():
     try:
         # Check if docker is installed
-        if subprocess.call("command -v docker > /dev/null", shell=True) != 0:
+        if shutil.which("docker") is None:
             return None
-            
+
         # Get container name, image, and status
-        cmd = "docker ps -a --format '{{.Names}}|{{.Image}}|{{.Status}}'"
-        output = subprocess.check_output(cmd, shell=True).decode().splitlines()
+        output = yield ["docker", "ps", "-a", "--format", "{{.Names}}|{{.Image}}|{{.Status}}"]
         containers = []
-        for line in output:
+        for line in output.splitlines():
             parts = line.split('|')
             if len(parts) == 3:
                 containers.append({
@@ -123,49 +928,432 @@ def get_docker_containers():
     except Exception:
         return []
 
+# /proc/meminfo fields parsed into fixed slots (kB unless noted)
+MEMINFO_FIELDS = (
+    b"MemTotal:", b"MemFree:", b"MemAvailable:", b"Buffers:", b"Cached:", b"SwapCached:",
+    b"SwapTotal:", b"SwapFree:", b"Dirty:", b"Writeback:", b"Shmem:", b"SReclaimable:", b"SUnreclaim:",
+    b"HugePages_Total:", b"HugePages_Free:", b"Hugepagesize:",  # HugePages_* are page counts
+)
+MEMINFO_INDEX = {key: slot for slot, key in enumerate(MEMINFO_FIELDS)}
+meminfo_values = [None] * len(MEMINFO_FIELDS)
+
 def get_memory_info():
     try:
-        # Use /proc/meminfo for more reliable parsing
-        meminfo = {}
-        with open('/proc/meminfo', 'r') as f:
-            for line in f:
-                parts = line.split(':')
-                if len(parts) == 2:
-                    meminfo[parts[0].strip()] = parts[1].strip()
-        
-        total_kb = int(meminfo['MemTotal'].split()[0])
-        avail_kb = int(meminfo.get('MemAvailable', '0').split()[0])
-        
+        meminfo = proc_file('/proc/meminfo', one_shot=True)
+        meminfo.read()
+        (total_kb, free_kb, avail_kb, buffers_kb, cached_kb, swap_cached_kb, swap_total_kb, swap_free_kb,
+         dirty_kb, writeback_kb, shmem_kb, slab_reclaimable_kb, slab_unreclaimable_kb,
+         hugepages_total, hugepages_free, hugepage_kb) = [
+            value or 0 for value in meminfo.scan(MEMINFO_INDEX, meminfo_values)]
+        if not total_kb:
+            raise ValueError("MemTotal missing from /proc/meminfo")
+
         total_mb = total_kb // 1024
         used_mb = (total_kb - avail_kb) // 1024
         percent = (used_mb / total_mb) * 100
-        
+
         return {
+            "total_bytes": total_kb * 1024,
+            "used_bytes": (total_kb - avail_kb) * 1024,
+            "available_bytes": avail_kb * 1024,
+            "used_ratio": ratio(total_kb - avail_kb, total_kb),
+            "breakdown": {
+                # Memory not accounted to any cache: process memory, page
+                # tables, kernel stacks and reserved huge pages
+                "apps_bytes": max(0, total_kb - free_kb - buffers_kb - cached_kb - slab_reclaimable_kb
+                                  - slab_unreclaimable_kb) * 1024,
+                "buffers_bytes": buffers_kb * 1024,
+                "cached_bytes": cached_kb * 1024,  # includes shmem
+                "shmem_bytes": shmem_kb * 1024,
+                "slab_reclaimable_bytes": slab_reclaimable_kb * 1024,
+                "slab_unreclaimable_bytes": slab_unreclaimable_kb * 1024,
+                "free_bytes": free_kb * 1024,
+                "dirty_bytes": dirty_kb * 1024,
+                "writeback_bytes": writeback_kb * 1024,
+                "hugepages_total_bytes": hugepages_total * hugepage_kb * 1024,
+                "hugepages_free_bytes": hugepages_free * hugepage_kb * 1024,
+            },
+            "swap": {
+                "total_bytes": swap_total_kb * 1024,
+                "used_bytes": (swap_total_kb - swap_free_kb) * 1024,
+                "free_bytes": swap_free_kb * 1024,
+                "cached_bytes": swap_cached_kb * 1024,
+                "used_ratio": ratio(swap_total_kb - swap_free_kb, swap_total_kb),
+            },
             "total": f"{total_mb} MB",
             "used": f"{used_mb} MB",
             "percent": f"{percent:.1f}%"
         }
     except Exception:
-        return {"total": "N/A", "used": "N/A", "percent": "0%"}
+        return {"total_bytes": None, "used_bytes": None, "available_bytes": None, "used_ratio": None,
+                "breakdown": None, "swap": None, "total": "N/A", "used": "N/A", "percent": "0%"}
+
+# Global state for stall time deltas: ({(resource, line): total_us}, monotonic time)
+prev_pressure = None
+PSI_RESOURCES = ("cpu", "memory", "io")
+
+def read_pressure(paths, previous):
+    # Pressure Stall Information from {resource: path} files; kernels without
+    # PSI (or booted with psi=0) fail to open or read these files and the
+    # resource is left out. Returns (pressure, state for the next call).
+    now = time.monotonic()
+    totals = {}
+    pressure = {}
+    for resource, path in paths.items():
+        try:
+            lines = read_proc(path, one_shot=True).splitlines()
+            pressure[resource] = {}
+            for line in lines:
+                kind, *values = line.split()
+                stats = dict(value.split(b"=") for value in values)
+                total_us = int(stats[b"total"])
+                totals[(resource, kind)] = total_us
+                stall_ratio = None
+                if previous is not None and (resource, kind) in previous[0] and now > previous[1]:
+                    stalled = (total_us - previous[0][(resource, kind)]) / 1e6
+                    stall_ratio = round(max(0.0, min(1.0, stalled / (now - previous[1]))), 4)
+                pressure[resource][kind.decode()] = {
+                    "avg10_ratio": round(float(stats[b"avg10"]) / 100, 4),
+                    "avg60_ratio": round(float(stats[b"avg60"]) / 100, 4),
+                    "avg300_ratio": round(float(stats[b"avg300"]) / 100, 4),
+                    "total_seconds": total_us / 1e6,
+                    "stall_ratio": stall_ratio,
+                }
+        except (OSError, ValueError, KeyError):
+            pressure.pop(resource, None)
+    return pressure or None, (totals, now)
+
+def get_load_info():
+    global prev_pressure
+    try:
+        fields = read_proc('/proc/loadavg', one_shot=True).split()
+        runnable, _, threads = fields[3].partition(b"/")
+        load = {
+            "avg1": float(fields[0]),
+            "avg5": float(fields[1]),
+            "avg15": float(fields[2]),
+            "runnable": int(runnable),
+            "threads": int(threads),
+        }
+    except (OSError, ValueError, IndexError):
+        load = {"avg1": None, "avg5": None, "avg15": None, "runnable": None, "threads": None}
+
+    pressure, prev_pressure = read_pressure(
+        {resource: f'/proc/pressure/{resource}' for resource in PSI_RESOURCES}, prev_pressure)
+    return {**load, "pressure": pressure}
+
+# /proc/vmstat counters published as rates; pgscan/pgsteal are summed over
+# the reclaim paths (kswapd, direct, khugepaged, proactive) the kernel has
+VMSTAT_RATES = {
+    "page_faults": (b"pgfault",),
+    "major_faults": (b"pgmajfault",),
+    "swap_ins": (b"pswpin",),
+    "swap_outs": (b"pswpout",),
+    "pages_scanned": (b"pgscan_kswapd", b"pgscan_direct", b"pgscan_khugepaged", b"pgscan_proactive"),
+    "pages_stolen": (b"pgsteal_kswapd", b"pgsteal_direct", b"pgsteal_khugepaged", b"pgsteal_proactive"),
+    "oom_kills": (b"oom_kill",),
+    "compaction_stalls": (b"compact_stall",),
+}
+VMSTAT_FIELDS = [key for keys in VMSTAT_RATES.values() for key in keys]
+VMSTAT_INDEX = {key: slot for slot, key in enumerate(VMSTAT_FIELDS)}
+vmstat_values = [None] * len(VMSTAT_FIELDS)
+prev_vmstat = None  # ({rate name: counter}, monotonic time)
+last_oom_kill = None  # Wall clock time the oom_kill counter last went up
+
+def get_vmstat_info():
+    global prev_vmstat, last_oom_kill
+    result = {f"{name}_per_second": None for name in VMSTAT_RATES}
+    result.update({"oom_kills_total": None, "last_oom_kill": last_oom_kill})
+    try:
+        vmstat = proc_file('/proc/vmstat', 8192)
+        vmstat.read()
+        values = dict(zip(VMSTAT_FIELDS, vmstat.scan(VMSTAT_INDEX, vmstat_values)))
+    except (OSError, ValueError):
+        return result
+    now = time.monotonic()
+    counters = {name: sum(values[key] or 0 for key in keys) for name, keys in VMSTAT_RATES.items()}
+
+    if prev_vmstat is not None and now > prev_vmstat[1]:
+        previous, elapsed = prev_vmstat[0], now - prev_vmstat[1]
+        for name, value in counters.items():
+            result[f"{name}_per_second"] = round(max(0, value - previous[name]) / elapsed, 1)
+        if counters["oom_kills"] > previous["oom_kills"]:
+            last_oom_kill = time.time()
+    prev_vmstat = (counters, now)
+    result["oom_kills_total"] = counters["oom_kills"]
+    result["last_oom_kill"] = last_oom_kill
+    return result
+
+# --- CGROUP V2 ---
+# Usage of one cgroup against its effective limits, for monitors running in a
+# container or under a systemd slice. "auto" turns this on when a cgroup is
+# configured, or inside a cgroup namespace (own cgroup "/") with CPU or memory
+# limits; a host service in its own slice keeps reporting the host.
+CGROUP_MEMORY_STAT_FIELDS = (b"anon", b"file", b"kernel", b"shmem", b"file_dirty", b"file_writeback", b"sock")
+CGROUP_MEMORY_STAT_INDEX = {key: slot for slot, key in enumerate(CGROUP_MEMORY_STAT_FIELDS)}
+cgroup_memory_stat_values = [None] * len(CGROUP_MEMORY_STAT_FIELDS)
+CGROUP_CPU_STAT_FIELDS = (b"usage_usec", b"user_usec", b"system_usec", b"nr_periods", b"nr_throttled", b"throttled_usec")
+CGROUP_CPU_STAT_INDEX = {key: slot for slot, key in enumerate(CGROUP_CPU_STAT_FIELDS)}
+cgroup_cpu_stat_values = [None] * len(CGROUP_CPU_STAT_FIELDS)
+CGROUP_IO_FIELDS = (b"rbytes", b"wbytes", b"rios", b"wios")
+
+cgroup_path = None  # Resolved on first use, "" when cgroup mode is off
+prev_cgroup = None  # ({counter: value}, monotonic time)
+prev_cgroup_pressure = None
+
+def own_cgroup():
+    # cgroup v2 path of this process from the "0::<path>" line
+    with open('/proc/self/cgroup', 'r') as f:
+        for line in f:
+            if line.startswith('0::'):
+                return line[3:].strip()
+    return None
+
+def resolve_cgroup_path():
+    if CGROUP_MODE == "off" or not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        return ""
+    path = CGROUP_PATH or own_cgroup()
+    if path is None:
+        return ""
+    directory = os.path.join(CGROUP_ROOT, path.lstrip("/"))
+    if CGROUP_MODE == "auto" and not CGROUP_PATH:
+        limited = any(os.path.exists(os.path.join(directory, name)) for name in ("cpu.max", "memory.max"))
+        if path != "/" or not limited:
+            return ""
+    return path if os.path.isdir(directory) else ""
+
+def read_cgroup_value(directory, name):
+    # Single-value file: an integer, or None for "max" or a missing file
+    try:
+        value = read_proc(os.path.join(directory, name)).strip()
+    except OSError:
+        return None
+    return None if value == b"max" else int(value)
+
+def cgroup_cpu_limit(directory):
+    # Effective CPU limit in cores: the cpu.max quota, else the cpuset size
+    try:
+        quota, period = read_proc(os.path.join(directory, "cpu.max")).split()
+        if quota != b"max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        cpus = 0
+        for part in read_proc(os.path.join(directory, "cpuset.cpus.effective")).strip().split(b","):
+            low, _, high = part.partition(b"-")
+            cpus += int(high or low) - int(low) + 1
+        if cpus:
+            return float(cpus)
+    except (OSError, ValueError):
+        pass
+    return float(read_cpu_count())
+
+def read_cgroup_io(directory):
+    # rbytes/wbytes/rios/wios summed over all devices in io.stat
+    totals = dict.fromkeys(CGROUP_IO_FIELDS, 0)
+    try:
+        content = read_proc(os.path.join(directory, "io.stat"))
+    except OSError:
+        return None
+    for line in content.splitlines():
+        for item in line.split()[1:]:
+            key, _, value = item.partition(b"=")
+            if key in totals:
+                totals[key] += int(value)
+    return totals
+
+def get_cgroup_info():
+    global cgroup_path, prev_cgroup, prev_cgroup_pressure
+    if cgroup_path is None:
+        cgroup_path = resolve_cgroup_path()
+    if not cgroup_path:
+        return None
+    directory = os.path.join(CGROUP_ROOT, cgroup_path.lstrip("/"))
+    now = time.monotonic()
+    counters = {}
+
+    cpu = None
+    try:
+        cpu_stat = proc_file(os.path.join(directory, "cpu.stat"))
+        cpu_stat.read()
+        usage_usec, user_usec, system_usec, periods, throttled, throttled_usec = [
+            value or 0 for value in cpu_stat.scan(CGROUP_CPU_STAT_INDEX, cgroup_cpu_stat_values)]
+        counters.update({"usage_usec": usage_usec, "periods": periods, "throttled": throttled,
+                         "throttled_usec": throttled_usec})
+        limit = cgroup_cpu_limit(directory)
+        cpu = {"limit_cores": round(limit, 2), "usage_cores": None, "usage_ratio": None,
+               "throttled_ratio": None, "throttled_periods_ratio": None,
+               "user_seconds": user_usec / 1e6, "system_seconds": system_usec / 1e6}
+    except OSError:
+        pass
+
+    memory = None
+    current = read_cgroup_value(directory, "memory.current")
+    if current is not None:
+        # Without memory.max the host's memory is the limit
+        configured = read_cgroup_value(directory, "memory.max")
+        limits = [v for v in (configured, os.sysconf('SC_PHYS_PAGES') * PAGE_SIZE) if v]
+        limit = min(limits) if limits else None
+        memory = {"current_bytes": current, "limit_bytes": limit, "limited": configured is not None,
+                  "used_ratio": ratio(current, limit) if limit else None,
+                  "swap_current_bytes": read_cgroup_value(directory, "memory.swap.current"),
+                  "swap_limit_bytes": read_cgroup_value(directory, "memory.swap.max")}
+        try:
+            memory_stat = proc_file(os.path.join(directory, "memory.stat"))
+            memory_stat.read()
+            for key, value in zip(CGROUP_MEMORY_STAT_FIELDS,
+                                  memory_stat.scan(CGROUP_MEMORY_STAT_INDEX, cgroup_memory_stat_values)):
+                memory[f"{key.decode()}_bytes"] = value
+        except OSError:
+            pass
+        try:
+            events = proc_file(os.path.join(directory, "memory.events"))
+            events.read()
+            oom_kills = events.field(b"oom_kill ")
+            memory["oom_kills_total"] = int(oom_kills) if oom_kills is not None else None
+        except OSError:
+            memory["oom_kills_total"] = None
+
+    io = None
+    io_totals = read_cgroup_io(directory)
+    if io_totals is not None:
+        counters.update({key.decode(): value for key, value in io_totals.items()})
+        io = {"read_bytes_per_second": None, "write_bytes_per_second": None,
+              "read_ios_per_second": None, "write_ios_per_second": None}
+
+    # Rates and ratios over the interval since the previous collection
+    if prev_cgroup is not None and now > prev_cgroup[1]:
+        previous, elapsed = prev_cgroup[0], now - prev_cgroup[1]
+        delta = {key: max(0, value - previous[key]) for key, value in counters.items() if key in previous}
+        if cpu is not None and "usage_usec" in delta:
+            cpu["usage_cores"] = round(delta["usage_usec"] / 1e6 / elapsed, 3)
+            cpu["usage_ratio"] = round(min(1.0, cpu["usage_cores"] / cpu["limit_cores"]), 4) if cpu["limit_cores"] else None
+            # Share of wall time the cgroup spent throttled, and of the CFS
+            # periods in which the quota ran out
+            cpu["throttled_ratio"] = round(min(1.0, delta["throttled_usec"] / 1e6 / elapsed), 4)
+            cpu["throttled_periods_ratio"] = ratio(delta["throttled"], delta["periods"]) if delta["periods"] else 0.0
+        if io is not None and "rbytes" in delta:
+            io["read_bytes_per_second"] = round(delta["rbytes"] / elapsed)
+            io["write_bytes_per_second"] = round(delta["wbytes"] / elapsed)
+            io["read_ios_per_second"] = round(delta["rios"] / elapsed, 1)
+            io["write_ios_per_second"] = round(delta["wios"] / elapsed, 1)
+    prev_cgroup = (counters, now)
+
+    pressure, prev_cgroup_pressure = read_pressure(
+        {resource: os.path.join(directory, f"{resource}.pressure") for resource in PSI_RESOURCES},
+        prev_cgroup_pressure)
+    return {
+        "path": cgroup_path,
+        "cpu": cpu,
+        "memory": memory,
+        "io": io,
+        "pressure": pressure,
+    }
+# ---------------------
+
+# Per-process state between scans: pid -> (starttime, utime + stime ticks,
+# monotonic time of the read, cpu ratio, rss bytes, name). The starttime tells
+# a reused PID from the process seen before.
+process_cache = {}
+process_cursor = 0  # Last PID read; the next scan continues after it
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def read_process_stat(pid):
+    # (name, starttime, cpu ticks, rss pages) from /proc/[pid]/stat; the name
+    # may contain spaces and parentheses, so fields are counted from the last ")"
+    with open(f'/proc/{pid}/stat', 'rb') as f:
+        data = f.read()
+    name_end = data.rindex(b")")
+    fields = data[name_end + 2:].split()  # fields[0] is field 3 (state)
+    name = data[data.index(b"(") + 1:name_end].decode(errors='replace')
+    return name, int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21])
+
+def get_process_info():
+    global process_cursor
+    deadline = time.monotonic() + PROCESS_SCAN_BUDGET
+    # /proc lists PIDs in ascending order
+    pids = [int(entry.name) for entry in os.scandir('/proc') if entry.name.isdigit()]
+    for pid in process_cache.keys() - set(pids):
+        del process_cache[pid]
+
+    # Round-robin: start after the PID the previous scan stopped at and stop
+    # when the time budget runs out; unread processes keep their last values
+    start = bisect.bisect_right(pids, process_cursor)
+    scanned = 0
+    for pid in pids[start:] + pids[:start]:
+        if scanned % 32 == 0 and scanned and time.monotonic() > deadline:
+            break
+        try:
+            name, starttime, ticks, rss = read_process_stat(pid)
+        except (OSError, ValueError, IndexError):
+            process_cache.pop(pid, None)  # exited while scanning
+            continue
+        now = time.monotonic()
+        cpu = None
+        previous = process_cache.get(pid)
+        if previous is not None and previous[0] == starttime and now > previous[2]:
+            cpu = max(0.0, (ticks - previous[1]) / CLOCK_TICKS / (now - previous[2]))
+        process_cache[pid] = (starttime, ticks, now, cpu, rss * PAGE_SIZE, name)
+        process_cursor = pid
+        scanned += 1
+
+    def entry(item):
+        pid, (_, _, _, cpu, rss, name) = item
+        return {"pid": pid, "name": name, "cpu_ratio": round(cpu, 4) if cpu is not None else None, "rss_bytes": rss}
+
+    # Heap-based top-N, no sort of the whole process table
+    return {
+        "count": len(pids),
+        "scanned": scanned,
+        # Processes without a CPU delta yet (first scan, newly seen) are not ranked
+        "top_cpu": [entry(item) for item in heapq.nlargest(TOP_PROCESSES,
+                                                           (item for item in process_cache.items() if item[1][3] is not None),
+                                                           key=lambda item: item[1][3])],
+        "top_memory": [entry(item) for item in heapq.nlargest(TOP_PROCESSES, process_cache.items(),
+                                                              key=lambda item: item[1][4])]
+    }
 
+@command_collector
 def get_disk_info():
     try:
-        cmd = "df -h / | tail -1"
-        parts = subprocess.check_output(cmd, shell=True).decode().split()
+        if COLLECTOR_BACKEND == "native":
+            # The root filesystem from the shared scan; a root the fstype
+            # table hides (overlay in a container) is stat'ed on its own
+            root = next((fs for fs in scan_filesystems() if fs[1] == "/"), None)
+            if root is None:
+                result = statvfs_all(['/'])['/']
+                if isinstance(result, OSError):
+                    raise result
+                root = (None, '/', None) + (result or (None, None, None))
+            size, used, avail = root[3:]
+            if size is None:
+                return {"total_bytes": None, "used_bytes": None, "free_bytes": None, "used_ratio": None,
+                        "status": "unresponsive", "total": "N/A", "used": "N/A", "free": "N/A", "percent": "0%"}
+        else:
+            output = yield ["df", "-B1", "--output=size,used,avail", "/"]
+            size, used, avail = (int(x) for x in output.splitlines()[-1].split())
         return {
-            "total": parts[1],
-            "used": parts[2],
-            "free": parts[3],
-            "percent": parts[4]
+            "total_bytes": size,
+            "used_bytes": used,
+            "free_bytes": avail,
+            "used_ratio": ratio(used, used + avail),
+            "total": human_size(size),
+            "used": human_size(used),
+            "free": human_size(avail),
+            "percent": df_percent(used, avail)
         }
     except Exception:
-        return {"total": "N/A", "used": "N/A", "free": "N/A", "percent": "0%"}
+        return {"total_bytes": None, "used_bytes": None, "free_bytes": None, "used_ratio": None,
+                "total": "N/A", "used": "N/A", "free": "N/A", "percent": "0%"}
 
+@command_collector
 def get_ufw_stats():
     try:
         # Check if UFW is installed and active
         try:
-            status_output = subprocess.check_output("ufw status", shell=True).decode().strip()
+            status_output = (yield ["ufw", "status"]).strip()
             is_active = "Status: active" in status_output
         except Exception:
             is_active = False
@@ -173,57 +1361,55 @@ def get_ufw_stats():
         if not is_active:
             return {"active": False, "top_blocked": [], "ports": {}}
 
-        # Get lines containing [UFW BLOCK] from dmesg
-        cmd = "dmesg | grep '\[UFW BLOCK\]' | tail -n 1000"
-        try:
-            output = subprocess.check_output(cmd, shell=True).decode().splitlines()
-        except subprocess.CalledProcessError:
-            # grep returns 1 if no matches found
-            output = []
-        
+        # Get lines containing [UFW BLOCK] from dmesg (last 1000)
+        dmesg_output = yield ["dmesg"]
+        block_lines = [line for line in dmesg_output.splitlines() if '[UFW BLOCK]' in line]
+        output = block_lines[-1000:]
+
         blocks = []
         port_counts = {}
         pair_counts = {}
-        
+
         for line in output:
-            import re
             src_match = re.search(r'SRC=([^\s]+)', line)
             dpt_match = re.search(r'DPT=([^\s]+)', line)
-            
+
             if src_match and dpt_match:
                 src = src_match.group(1)
                 dpt = dpt_match.group(1)
-                
+
                 # Count pairs for the table
                 pair = f"{src}|{dpt}"
                 pair_counts[pair] = pair_counts.get(pair, 0) + 1
-                
+
                 # Count ports for the chart
                 port_counts[dpt] = port_counts.get(dpt, 0) + 1
-        
+
         # Sort and get top 10 pairs
         top_pairs_raw = sorted(pair_counts.items(), key=lambda x: x[1], reverse=True)[:10]
         top_blocked = []
         for p_str, count in top_pairs_raw:
             ip, port = p_str.split('|')
             top_blocked.append({"ip": ip, "port": port, "count": count})
-        
+
         # Sort and get top ports (for better visualization)
         top_ports = dict(sorted(port_counts.items(), key=lambda x: x[1], reverse=True)[:10])
-        
+
         return {
             "active": True,
             "top_blocked": top_blocked,
-            "ports": top_ports
+            "ports": top_ports,
+            "blocked_total": len(block_lines)
         }
     except Exception as e:
         return {"active": False, "top_blocked": [], "ports": {}}
 
+@command_collector
 def get_fail2ban_stats():
     try:
         # Check if fail2ban is active
         try:
-            status = subprocess.check_output("systemctl is-active fail2ban", shell=True).decode().strip()
+            status = (yield ["systemctl", "is-active", "fail2ban"]).strip()
             if status != "active":
                 return {"active": False}
         except Exception:
@@ -231,8 +1417,7 @@ def get_fail2ban_stats():
 
         # Get list of jails
         try:
-            client_status = subprocess.check_output("fail2ban-client status", shell=True).decode()
-            import re
+            client_status = yield ["fail2ban-client", "status"]
             jails_match = re.search(r"Jail list:\s+(.*)", client_status)
             if not jails_match:
                 return {"active": True, "monthly_top": [], "current_top": [], "jails_dist": {}}
@@ -249,14 +1434,13 @@ def get_fail2ban_stats():
             # We look for "Ban" lines in the current month in both current and rotated log
             log_files = ["/var/log/fail2ban.log", "/var/log/fail2ban.log.1"]
             existing_logs = [f for f in log_files if os.path.exists(f)]
-            
+
             if existing_logs:
-                # Combine logs for grep
-                logs_str = " ".join(existing_logs)
-                cmd = f"grep -h 'Ban ' {logs_str} | grep '^{current_month}'"
                 try:
-                    log_output = subprocess.check_output(cmd, shell=True).decode().splitlines()
-                    for line in log_output:
+                    log_output = yield ["grep", "-h", "Ban ", *existing_logs]
+                    for line in log_output.splitlines():
+                        if not line.startswith(current_month):
+                            continue
                         # Parse jail and IP
                         # Example: 2026-02-16 12:12:12,123 fail2ban.actions [123]: NOTICE [sshd] Ban 1.2.3.4
                         match = re.search(r"NOTICE\s+\[(.*?)\]\s+Ban\s+(.*)", line)
@@ -265,7 +1449,7 @@ def get_fail2ban_stats():
                             ip = match.group(2)
                             key = f"{ip}|{jail}"
                             monthly_stats[key] = monthly_stats.get(key, 0) + 1
-                            
+
                             # Aggregated distribution for the chart
                             jails_dist[jail] = jails_dist.get(jail, 0) + 1
                 except subprocess.CalledProcessError:
@@ -273,18 +1457,17 @@ def get_fail2ban_stats():
         except Exception:
             pass
 
-        # Get currently banned IPs for the "Active" table
+        # Get currently banned IPs for the "Active" table (all jails queried at once)
         current_banned = []
-        for jail in jails:
-            try:
-                jail_status = subprocess.check_output(f"fail2ban-client status {jail}", shell=True).decode()
-                ips_match = re.search(r"Banned IP list:\s+(.*)", jail_status)
-                if ips_match:
-                    ips = ips_match.group(1).split()
-                    for ip in ips:
-                        current_banned.append({"ip": ip, "jail": jail})
-            except Exception:
+        jail_statuses = yield tuple(["fail2ban-client", "status", jail] for jail in jails)
+        for jail, jail_status in zip(jails, jail_statuses):
+            if jail_status is None:
                 continue
+            ips_match = re.search(r"Banned IP list:\s+(.*)", jail_status)
+            if ips_match:
+                ips = ips_match.group(1).split()
+                for ip in ips:
+                    current_banned.append({"ip": ip, "jail": jail})
 
         # Sort and get top 10 monthly
         top_monthly_raw = sorted(monthly_stats.items(), key=lambda x: x[1], reverse=True)[:10]
@@ -297,54 +1480,945 @@ def get_fail2ban_stats():
             "active": True,
             "monthly_top": top_monthly,
             "current_top": current_banned[:10],
-            "jails_dist": jails_dist
+            "jails_dist": jails_dist,
+            "banned_total": len(current_banned)
         }
     except Exception:
         return {"active": False}
 
+@command_collector
 def get_system_info():
     try:
+        if COLLECTOR_BACKEND == "native":
+            facts = get_host_facts()
+            uptime_seconds = read_uptime()
+            return {
+                "hostname": facts["hostname"],
+                "uptime_seconds": int(uptime_seconds),
+                "uptime": format_uptime(uptime_seconds),
+                "kernel": facts["kernel"],
+                "os": facts["os"],
+                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+        uptime, kernel = yield (["uptime", "-p"], ["uname", "-r"])
+        os_name = read_os_name()
         return {
             "hostname": socket.gethostname(),
-            "uptime": subprocess.check_output("uptime -p", shell=True).decode().strip(),
-            "kernel": subprocess.check_output("uname -r", shell=True).decode().strip(),
-            "os": subprocess.check_output("cat /etc/os-release | grep PRETTY_NAME | cut -d'=' -f2 | tr -d '\"'", shell=True).decode().strip(),
+            "uptime_seconds": int(read_uptime()),
+            "uptime": uptime.strip() if uptime is not None else "N/A",
+            "kernel": kernel.strip() if kernel is not None else "N/A",
+            "os": os_name,
             "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
     except Exception:
-        return {"hostname": "N/A", "uptime": "N/A", "kernel": "N/A", "os": "N/A", "last_update": "N/A"}
+        return {"hostname": "N/A", "uptime_seconds": None, "uptime": "N/A", "kernel": "N/A", "os": "N/A",
+                "last_update": "N/A"}
 
-def main():
-    print("KKDash Monitor started...")
+# Snapshot keys and the collectors that produce them, in data.json order
+COLLECTORS = [
+    ("cpu", get_cpu_info),
+    ("memory", get_memory_info),
+    ("load", get_load_info),
+    ("processes", get_process_info),
+    ("vmstat", get_vmstat_info),
+    ("cgroup", get_cgroup_info),
+    ("disk", get_disk_info),
+    ("mounts", get_mount_info),
+    ("users", get_logged_users),
+    ("services", get_service_status),
+    ("docker_containers", get_docker_containers),
+    ("system", get_system_info),
+    ("ufw", get_ufw_stats),
+    ("fail2ban", get_fail2ban_stats),
+]
+
+# Collectors that call statvfs through the native backend
+FILESYSTEM_COLLECTORS = {"disk", "mounts"}
+
+# Value reported when a collector has never finished within its deadline
+COLLECTOR_DEFAULTS = {
+    "cpu": {"usage_ratio": None, "usage": "N/A", "model": "N/A", "core_count": None, "cores": "N/A",
+            "core_usage_ratio": [], "breakdown": None, "context_switches_per_second": None,
+            "interrupts_per_second": None, "sampler": None},
+    "memory": {"total_bytes": None, "used_bytes": None, "available_bytes": None, "used_ratio": None,
+               "breakdown": None, "swap": None, "total": "N/A", "used": "N/A", "percent": "0%"},
+    "load": {"avg1": None, "avg5": None, "avg15": None, "runnable": None, "threads": None, "pressure": None},
+    "processes": {"count": None, "scanned": 0, "top_cpu": [], "top_memory": []},
+    "vmstat": {"oom_kills_total": None, "last_oom_kill": None},
+    "cgroup": None,
+    "disk": {"total_bytes": None, "used_bytes": None, "free_bytes": None, "used_ratio": None,
+             "total": "N/A", "used": "N/A", "free": "N/A", "percent": "0%"},
+    "mounts": [],
+    "users": [],
+    "services": {},
+    "docker_containers": None,
+    "system": {"hostname": "N/A", "uptime_seconds": None, "uptime": "N/A", "kernel": "N/A", "os": "N/A",
+               "last_update": "N/A"},
+    "ufw": {"active": False, "top_blocked": [], "ports": {}},
+    "fail2ban": {"active": False},
+}
+
+# Last good value and next due time of every collector
+collector_cache = {}
+collector_next_run = {}
+# Collectors still running from this or an earlier tick: key -> (future or
+# task, monotonic start time)
+collector_pending = {}
+
+def due_collectors(now):
+    # Collectors whose interval has elapsed; a collector still stuck from an
+    # earlier cycle is not started again
+    due = []
+    for key, collector in COLLECTORS:
+        if key not in collector_pending and now >= collector_next_run.get(key, 0):
+            due.append((key, collector))
+            collector_next_run[key] = now + COLLECTOR_INTERVALS.get(key, REFRESH_INTERVAL)
+    return due
+
+def build_snapshot(stale):
+    data = {"schema": SCHEMA_VERSION}
+    if SCHEMA_DISPLAY_HINTS:
+        data["display"] = DISPLAY_HINTS
+    for key, _ in COLLECTORS:
+        data[key] = strip_legacy_fields(key, collector_cache.get(key, COLLECTOR_DEFAULTS[key]))
+    # Keys that carry the last good value because their collector missed its deadline
+    data["stale"] = [key for key, _ in COLLECTORS if key in stale]
+    # Bumped whenever the cached host facts (model, cores, kernel, os, hostname) change
+    data["facts_version"] = host_facts_version
+    return data
+
+def collect_due(executor, now, until):
+    # Collectors run in the pool across ticks: the tick waits for them only
+    # until `until` (just before the next tick), so a slow collector can't
+    # hold back the fast ones. It keeps its last good value until it finishes
+    # and is reported stale once it has run past its deadline
+    for key, collector in due_collectors(now):
+        collector_pending[key] = (executor.submit(collector), time.monotonic())
+    futures_wait([future for future, _ in collector_pending.values()], timeout=max(0, until - time.monotonic()))
+
+    stale = set()
+    for key, (future, started) in list(collector_pending.items()):
+        if future.done():
+            del collector_pending[key]
+            try:
+                collector_cache[key] = future.result()
+            except Exception as e:
+                print(f"Collector {key} failed: {e}")
+        elif time.monotonic() - started >= COLLECTOR_TIMEOUTS.get(key, COLLECTOR_TIMEOUT):
+            stale.add(key)
+            if future.cancel():
+                # Never started because the pool was busy, retry on the next tick
+                del collector_pending[key]
+                collector_next_run[key] = 0
+
+    return build_snapshot(stale)
+
+async def collect_due_async(now, until):
+    # Collectors without an asyncio variant only read /proc and run inline;
+    # native filesystem collectors wait on statvfs and run on a thread, where
+    # a hung mount can't stall the loop
+    async def run(key, collector):
+        if key in FILESYSTEM_COLLECTORS and COLLECTOR_BACKEND == "native":
+            return await asyncio.to_thread(collector)
+        if hasattr(collector, "run_async"):
+            return await collector.run_async()
+        return collector()
+
+    # Every collector is a task that outlives the tick if it has to, as with
+    # the threads engine; a task past its deadline is cancelled, which also
+    # kills its command
+    for key, collector in due_collectors(now):
+        task = asyncio.ensure_future(asyncio.wait_for(run(key, collector), COLLECTOR_TIMEOUTS.get(key, COLLECTOR_TIMEOUT)))
+        collector_pending[key] = (task, time.monotonic())
+    if collector_pending:
+        await asyncio.wait([task for task, _ in collector_pending.values()], timeout=max(0, until - time.monotonic()))
+
+    stale = set()
+    for key, (task, _) in list(collector_pending.items()):
+        if not task.done():
+            continue
+        del collector_pending[key]
+        if task.cancelled():
+            continue
+        error = task.exception()
+        if isinstance(error, asyncio.TimeoutError):
+            stale.add(key)
+        elif error is not None:
+            print(f"Collector {key} failed: {error}")
+        else:
+            collector_cache[key] = task.result()
+
+    return build_snapshot(stale)
+
+class TickScheduler:
+    # Fixed-phase ticks on time.monotonic(): tick N is due at start + N * interval.
+    # A cycle that runs past the next deadline counts as an overrun and the missed
+    # ticks are skipped instead of being fired back to back.
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_tick = time.monotonic()
+        self.last_start = None
+        self.actual_interval = None
+        self.jitter = 0.0
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+
+    def start(self):
+        # Called on wake-up, returns the scheduled time of the current tick
+        now = time.monotonic()
+        scheduled = self.next_tick
+        self.jitter = now - scheduled
+        if self.last_start is not None:
+            self.actual_interval = now - self.last_start
+        self.last_start = now
+        self.ticks += 1
+        self.next_tick += self.interval
+        return scheduled
+
+    def publish_deadline(self):
+        # Latest time collectors are waited for in the current tick; the last
+        # tenth of the interval is left for building and publishing the snapshot
+        return self.next_tick - self.interval / 10
+
+    def delay(self):
+        # Seconds to sleep until the next tick, skipping ticks the cycle overran
+        now = time.monotonic()
+        if self.ticks and now > self.next_tick:
+            missed = int((now - self.next_tick) // self.interval) + 1
+            self.overruns += 1
+            self.skipped += missed
+            self.next_tick += missed * self.interval
+        return max(0.0, self.next_tick - now)
+
+    def stats(self):
+        return {
+            "target_interval": self.interval,
+            "interval": round(self.actual_interval, 4) if self.actual_interval is not None else None,
+            "jitter": round(self.jitter, 4),
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped_ticks": self.skipped
+        }
+
+# --- METRIC HISTORY ---
+# Usage ratios and security counters in fixed-layout ring files, one per metric
+# family and resolution, mapped into memory so appends write straight into the
+# page cache (no per-sample allocations) and the history survives restarts.
+# Layout of a ring file:
+#   header   magic, capacity, slots, fields, head, count, interval (HISTORY_HEADER, padded to 64 bytes)
+#   names    one NUL-padded HISTORY_NAME_SIZE-byte metric name per slot
+#   records  capacity x (uint32 timestamp + fields float32 per slot), NaN = no value
+# Raw files store one value per slot, rollup files min/max/avg/last/count.
+# Readers get zero-copy memoryviews over the same mapping; open a file with
+# open_history_file() to read it from another process while the monitor
+# writes it. The interval sits in what used to be header padding, so files
+# from before it was added keep their data.
+HISTORY_MAGIC = b"KKDRING2"
+HISTORY_HEADER = struct.Struct("<8sIIIIII")
+HISTORY_HEADER_SIZE = 64
+HISTORY_NAME_SIZE = 128
+HISTORY_AGGREGATES = ("min", "max", "avg", "last")
+
+def history_key(name):
+    # Name as stored in the names table. One that doesn't fit keeps a prefix
+    # cut on a character boundary plus a hash of the whole name, so it maps
+    # to the same column after a restart
+    data = name.encode()
+    if len(data) <= HISTORY_NAME_SIZE:
+        return name
+    digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+    return data[:HISTORY_NAME_SIZE - len(digest) - 1].decode(errors='ignore') + "~" + digest
+
+class MetricHistory:
+    fields = 1
+
+    def __init__(self, capacity, slots, path=None, interval=0, readonly=False):
+        self.interval = interval
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.buffer = self._open(path, capacity, slots, readonly) if path else None
+        if self.buffer is None:
+            if readonly:
+                raise OSError(f"cannot read history file {path}")
+            self.buffer = bytearray(self._size(capacity, slots))
+            HISTORY_HEADER.pack_into(self.buffer, 0, HISTORY_MAGIC, capacity, slots, self.fields, 0, 0, interval)
+        _, self.capacity, self.slots, self.fields, self.head, self.count, stored = HISTORY_HEADER.unpack_from(self.buffer)
+        if readonly:
+            self.interval = stored
+        elif stored != interval:
+            self._write_header()
+        self.width = 1 + self.slots * self.fields
+        offset = HISTORY_HEADER_SIZE + self.slots * HISTORY_NAME_SIZE
+        records = memoryview(self.buffer)[offset:]
+        self.timestamps = records.cast('I')
+        self.values = records.cast('f')
+        self._read_names()
+        self.written = None  # Timestamp of each slot's newest value, found on first need
+        self.dropped = set()  # Metrics already reported as not recorded
+
+    def _read_names(self):
+        self.names = []
+        for slot in range(self.slots):
+            start = HISTORY_HEADER_SIZE + slot * HISTORY_NAME_SIZE
+            self.names.append(bytes(self.buffer[start:start + HISTORY_NAME_SIZE]).rstrip(b"\0").decode(errors='replace'))
+        self.index = {name: slot for slot, name in enumerate(self.names) if name}
+
+    def _write_header(self):
+        HISTORY_HEADER.pack_into(self.buffer, 0, HISTORY_MAGIC, self.capacity, self.slots, self.fields,
+                                 self.head, self.count, self.interval)
+
+    def _refresh(self):
+        # A read-only mapping follows the writer: ring position and names
+        # are re-read before every query
+        if self.readonly:
+            self.head, self.count = HISTORY_HEADER.unpack_from(self.buffer)[4:6]
+            self._read_names()
+
+    def _size(self, capacity, slots):
+        return HISTORY_HEADER_SIZE + slots * HISTORY_NAME_SIZE + capacity * (1 + slots * self.fields) * 4
+
+    def _open(self, path, capacity, slots, readonly):
+        size = self._size(capacity, slots)
+        try:
+            if readonly:
+                with open(path, 'rb') as f:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                header = os.pread(fd, HISTORY_HEADER.size, 0)
+                if len(header) < HISTORY_HEADER.size or os.fstat(fd).st_size != size or \
+                        HISTORY_HEADER.unpack(header)[:4] != (HISTORY_MAGIC, capacity, slots, self.fields):
+                    # New file or a different retention/layout: start over
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, HISTORY_HEADER.pack(HISTORY_MAGIC, capacity, slots, self.fields, 0, 0, self.interval), 0)
+                return mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except (OSError, ValueError) as e:
+            print(f"Error opening history file {path}: {e}")
+            return None
+
+    def _last_written(self):
+        # Timestamp of the newest value in each slot (0 when it has none)
+        written = [0] * self.slots
+        remaining = set(range(self.slots))
+        for position in range(self.count - 1, -1, -1):
+            base = self._record(position) * self.width
+            for slot in list(remaining):
+                value = self.values[base + 1 + slot * self.fields]
+                if value == value:
+                    written[slot] = self.timestamps[base]
+                    remaining.discard(slot)
+            if not remaining:
+                break
+        return written
+
+    def _slot_for(self, name, timestamp):
+        name = history_key(name)
+        slot = self.index.get(name)
+        if slot is not None:
+            return slot
+        if "" in self.names:
+            slot = self.names.index("")
+        else:
+            # Hand over the column of the metric that has gone longest without
+            # samples (an unmounted USB stick, an old snap revision), once it
+            # has been quiet for HISTORY_SLOT_REUSE seconds or its data has
+            # aged out of the ring
+            if self.written is None:
+                self.written = self._last_written()
+            slot = min(range(self.slots), key=self.written.__getitem__)
+            idle = timestamp - self.written[slot]
+            retention = self.capacity * self.interval
+            if idle < min(HISTORY_SLOT_REUSE, retention):
+                if name not in self.dropped:
+                    print(f"History has no free column for {name}, all {self.slots} are in use; not recording it")
+                    self.dropped.add(name)
+                return None
+            if idle < retention:
+                print(f"History drops {self.names[slot]} (no samples for {int(idle)}s) to record {name}")
+            del self.index[self.names[slot]]
+            self.written[slot] = 0
+        # First sample of a new metric (e.g. a new mount); its column holds
+        # whatever an earlier metric left behind, so blank it
+        self.dropped.discard(name)
+        self.names[slot] = name
+        self.index[name] = slot
+        struct.pack_into(f"{HISTORY_NAME_SIZE}s", self.buffer, HISTORY_HEADER_SIZE + slot * HISTORY_NAME_SIZE,
+                         name.encode())
+        for record in range(self.capacity):
+            base = record * self.width + 1 + slot * self.fields
+            for field in range(self.fields):
+                self.values[base + field] = math.nan
+        return slot
+
+    def _written(self, slot, timestamp):
+        if self.written is not None:
+            self.written[slot] = timestamp
+
+    def _start_record(self, timestamp):
+        # Claim the next record in the ring, blank it and return its offset
+        base = self.head * self.width
+        for offset in range(base + 1, base + self.width):
+            self.values[offset] = math.nan
+        self.timestamps[base] = timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+        return base
+
+    def _last_timestamp(self):
+        return self.timestamps[self._record(self.count - 1) * self.width] if self.count else None
+
+    def append(self, timestamp, values):
+        with self.lock:
+            last = self._last_timestamp()
+            if last is not None and timestamp - last < self.interval:
+                return
+            base = self._start_record(int(timestamp))
+            for name, value in values.items():
+                if value is None:
+                    continue
+                slot = self._slot_for(name, timestamp)
+                if slot is not None:
+                    self.values[base + 1 + slot] = value
+                    self._written(slot, int(timestamp))
+
+    def _aggregates(self, offset):
+        # (min, max, avg, last, count) of one slot of one record
+        value = self.values[offset]
+        return (value, value, value, value, 1) if value == value else None
+
+    def _record(self, position):
+        # Ring index of the position-th oldest record
+        return (self.head - self.count + position) % self.capacity
+
+    def _bisect(self, timestamp):
+        # First chronological position with a timestamp >= the given one
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.timestamps[self._record(mid) * self.width] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def query(self, start, end, step, names=None, aggregate="avg"):
+        # Records in [start, end) merged into step-second buckets (server-side
+        # downsampling) with the given aggregate; buckets without data are None
+        with self.lock:
+            self._refresh()
+            # Requested name -> slot, long names looked up by their stored key
+            slots = {n: self.index[history_key(n)] for n in (names or self.index) if history_key(n) in self.index}
+            names = list(slots)
+            buckets = max(1, math.ceil((end - start) / step))
+            series = {name: [None] * buckets for name in names}
+            counts = {name: [0] * buckets for name in names}
+            for position in range(self._bisect(start), self._bisect(end)):
+                base = self._record(position) * self.width
+                bucket = min(int((self.timestamps[base] - start) // step), buckets - 1)
+                for name in names:
+                    stats = self._aggregates(base + 1 + slots[name] * self.fields)
+                    if stats is None:
+                        continue
+                    low, high, mean, last, n = stats
+                    current = series[name][bucket]
+                    if aggregate == "avg":
+                        series[name][bucket] = (current or 0.0) + mean * n
+                        counts[name][bucket] += n
+                    elif aggregate == "min":
+                        series[name][bucket] = low if current is None else min(current, low)
+                    elif aggregate == "max":
+                        series[name][bucket] = high if current is None else max(current, high)
+                    else:
+                        series[name][bucket] = last
+            if aggregate == "avg":
+                for name in names:
+                    series[name] = [None if v is None else v / n for v, n in zip(series[name], counts[name])]
+        return {
+            "start": start,
+            "end": end,
+            "step": step,
+            "resolution": self.interval,
+            "timestamps": [start + i * step for i in range(buckets)],
+            "series": {name: [None if v is None else round(v, 4) for v in values] for name, values in series.items()}
+        }
+
+class MetricRollup(MetricHistory):
+    # min/max/avg/last/count per slot and resolution-aligned bucket, updated in
+    # place as samples arrive so long ranges never touch the raw samples
+    fields = 5
+
+    def append(self, timestamp, values):
+        with self.lock:
+            bucket = int(timestamp) - int(timestamp) % self.interval
+            if self._last_timestamp() == bucket:
+                base = self._record(self.count - 1) * self.width
+            else:
+                base = self._start_record(bucket)
+            for name, value in values.items():
+                if value is None:
+                    continue
+                slot = self._slot_for(name, timestamp)
+                if slot is None:
+                    continue
+                self._written(slot, bucket)
+                offset = base + 1 + slot * self.fields
+                n = self.values[offset + 4]
+                if n == n and n > 0:
+                    self.values[offset] = min(self.values[offset], value)
+                    self.values[offset + 1] = max(self.values[offset + 1], value)
+                    self.values[offset + 2] += (value - self.values[offset + 2]) / (n + 1)
+                    self.values[offset + 4] = n + 1
+                else:
+                    self.values[offset] = self.values[offset + 1] = self.values[offset + 2] = value
+                    self.values[offset + 4] = 1
+                self.values[offset + 3] = value
+
+    def _aggregates(self, offset):
+        n = self.values[offset + 4]
+        if n == n and n > 0:
+            return self.values[offset], self.values[offset + 1], self.values[offset + 2], self.values[offset + 3], n
+        return None
+
+def open_history_file(path):
+    # Read-only view of a ring file that a running monitor keeps writing;
+    # raw or rollup store depending on the fields count in its header
+    with open(path, 'rb') as f:
+        header = f.read(HISTORY_HEADER.size)
+    if len(header) < HISTORY_HEADER.size or header[:8] != HISTORY_MAGIC:
+        raise ValueError(f"{path} is not a history ring file")
+    fields = HISTORY_HEADER.unpack(header)[3]
+    store = MetricRollup if fields == MetricRollup.fields else MetricHistory
+    return store(0, 0, path, readonly=True)
+
+def history_families():
+    # Family -> list of stores, raw samples first, then the rollups from fine to
+    # coarse. Mounts and security counters change slowly and are only sampled
+    # as often as their collectors run; mounts, with up to
+    # HISTORY_MOUNT_SLOTS columns, get a coarser sample and fewer rollups.
+    families = {
+        "usage": (3, HISTORY_INTERVAL, HISTORY_ROLLUPS),
+        "mounts": (HISTORY_MOUNT_SLOTS, max(HISTORY_MOUNT_INTERVAL, COLLECTOR_INTERVALS.get("mounts", 0)),
+                   HISTORY_MOUNT_ROLLUPS),
+        "security": (2, max(HISTORY_INTERVAL, COLLECTOR_INTERVALS.get("ufw", 0)), HISTORY_ROLLUPS),
+    }
+    stores = {}
+    for family, (slots, interval, rollups) in families.items():
+        path = os.path.join(HISTORY_DIR, f"{family}.ring") if HISTORY_DIR else None
+        stores[family] = [MetricHistory(max(1, int(HISTORY_RETENTION_DAYS * 86400 / interval)), slots, path, interval)]
+        for resolution, days in sorted(rollups.items()):
+            if resolution <= interval:
+                continue  # would only repeat the raw samples
+            path = os.path.join(HISTORY_DIR, f"{family}-{resolution}s.ring") if HISTORY_DIR else None
+            stores[family].append(MetricRollup(max(1, int(days * 86400 / resolution)), slots, path, resolution))
+    return stores
+
+def history_sample(data):
+    usage = {
+        "cpu": data["cpu"].get("usage_ratio"),
+        "memory": data["memory"].get("used_ratio"),
+        "disk": data["disk"].get("used_ratio"),
+    }
+    mounts = {f"mount:{mount['target']}": mount.get("used_ratio") for mount in data["mounts"]}
+    security = {
+        "ufw_blocks": (data["ufw"] or {}).get("blocked_total"),
+        "fail2ban_bans": (data["fail2ban"] or {}).get("banned_total"),
+    }
+    return {"usage": usage, "mounts": mounts, "security": security}
+
+def history_store(stores, start, step):
+    # Coarsest store that still reaches back to start without being coarser
+    # than the requested step; else the finest store reaching back that far;
+    # else the one with the longest retention
+    now = time.time()
+    covering = [s for s in stores if now - s.capacity * s.interval <= start]
+    fitting = [s for s in covering if s.interval <= step]
+    if fitting:
+        return fitting[-1]
+    return covering[0] if covering else max(stores, key=lambda s: s.capacity * s.interval)
+
+metric_history = {}
+
+def open_history():
+    metric_history.update(history_families())
+
+def record_history(data):
+    now = time.time()
+    for family, values in history_sample(data).items():
+        for store in metric_history.get(family, ()):
+            store.append(now, values)
+
+def history_response(query):
+    # /history?metrics=cpu,memory&range=3600&step=60&aggregate=max
+    # (or start=/end= epoch seconds; aggregate is one of min/max/avg/last)
+    params = {k: v[-1] for k, v in parse_qs(query).items()}
+    end = float(params.get("end", time.time()))
+    start = float(params.get("start", end - float(params.get("range", 3600))))
+    step = float(params.get("step", 0)) or max(HISTORY_INTERVAL, (end - start) / HISTORY_MAX_POINTS)
+    step = max(step, (end - start) / 10000)  # bound the response size
+    # inf/nan (or a span that overflows) would escape query() as OverflowError
+    if not all(math.isfinite(v) for v in (start, end, end - start, step)) or end < start or step <= 0:
+        raise ValueError("history range and step must be finite, with start <= end and step > 0")
+    aggregate = params.get("aggregate", "avg")
+    if aggregate not in HISTORY_AGGREGATES:
+        raise ValueError(f"unknown aggregate {aggregate}")
+    names = params["metrics"].split(",") if params.get("metrics") else None
+    result = {"start": start, "end": end, "step": step, "aggregate": aggregate,
+              "timestamps": [], "resolution": {}, "series": {}}
+    for family, stores in list(metric_history.items()):
+        store = history_store(stores, start, step)
+        data = store.query(start, end, step, names, aggregate)
+        result["timestamps"] = data["timestamps"]
+        result["resolution"][family] = data["resolution"]
+        result["series"].update(data["series"])
+    return result
+# ---------------------
+
+# --- HTTP SERVER ---
+# Optional built-in server: an asyncio event loop on its own thread serving
+# index.html, style.css and the latest snapshot from memory. Every response is
+# built once (plain and gzip) and the same bytes are written to all clients.
+HTTP_STATIC_FILES = {
+    "/index.html": ("index.html", "text/html; charset=utf-8"),
+    "/style.css": ("style.css", "text/css; charset=utf-8"),
+}
+HTTP_MAX_REQUEST_SIZE = 8192
+SSE_HEARTBEAT = 15  # Seconds between keep-alive comments on idle event streams
+SSE_MAX_BUFFER = 1 << 20  # Event stream clients with more unsent bytes than this are dropped
+DELTA_HISTORY = 120  # Snapshots kept for delta responses; older clients get a full snapshot
+
+def _http_head(status, headers):
+    lines = [f"HTTP/1.1 {status}"] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+class HTTPResource:
+    # Pre-built response bytes for one resource, shared by all requests
+    def __init__(self, body, content_type):
+        self.etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        common = [("Content-Type", content_type), ("Cache-Control", "no-cache"),
+                  ("ETag", self.etag), ("Vary", "Accept-Encoding")]
+        self.head = _http_head("200 OK", common + [("Content-Length", len(body))])
+        self.full = self.head + body
+        compressed = gzip.compress(body, mtime=0)
+        if len(compressed) < len(body):
+            self.gzip_head = _http_head("200 OK", common + [("Content-Encoding", "gzip"),
+                                                            ("Content-Length", len(compressed))])
+            self.gzip_full = self.gzip_head + compressed
+        else:
+            self.gzip_head, self.gzip_full = self.head, self.full
+        self.not_modified = _http_head("304 Not Modified", [("ETag", self.etag), ("Cache-Control", "no-cache")])
+
+    def response(self, method, headers):
+        if headers.get(b"if-none-match", b"").decode(errors="replace") == self.etag:
+            return self.not_modified
+        if b"gzip" in headers.get(b"accept-encoding", b""):
+            return self.gzip_head if method == b"HEAD" else self.gzip_full
+        return self.head if method == b"HEAD" else self.full
+
+HTTP_NOT_FOUND = _http_head("404 Not Found", [("Content-Length", 0)])
+HTTP_NOT_ALLOWED = _http_head("405 Method Not Allowed", [("Allow", "GET, HEAD"), ("Content-Length", 0)])
+HTTP_BAD_REQUEST = _http_head("400 Bad Request", [("Content-Length", 0), ("Connection", "close")])
+SSE_HEAD = _http_head("200 OK", [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache"),
+                                 ("Connection", "keep-alive"), ("X-Accel-Buffering", "no")])
+SSE_HEARTBEAT_EVENT = b": ping\n\n"
+
+def sse_event(event, seq, payload):
+    # Single-line JSON fits in one data field
+    return b"event: " + event + b"\nid: " + str(seq).encode() + b"\ndata: " + payload + b"\n\n"
+
+def merge_patch(old, new):
+    # RFC 7396 JSON Merge Patch from old to new: changed subtrees only,
+    # removed keys as null, lists replaced as a whole. Lossy for null values:
+    # a key whose value becomes None is also sent as null, so applying the
+    # patch deletes it and the result has the key missing where new has null
+    # (cgroup, docker_containers, rates without a previous sample). Readers
+    # must treat a missing key like null.
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif old[key] != value:
+            if isinstance(value, dict) and isinstance(old[key], dict):
+                patch[key] = merge_patch(old[key], value)
+            else:
+                patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+class DashboardHTTPProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b""
+        self.streaming = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if self.streaming:
+            self.server.subscribers.discard(self.transport)
+
+    def data_received(self, data):
+        if self.streaming:
+            return
+        self.buffer += data
+        # Handles pipelined requests; request bodies are not supported
+        while not self.transport.is_closing():
+            end = self.buffer.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.buffer) > HTTP_MAX_REQUEST_SIZE:
+                    self.transport.write(HTTP_BAD_REQUEST)
+                    self.transport.close()
+                return
+            request, self.buffer = self.buffer[:end], self.buffer[end + 4:]
+            self.handle_request(request)
+
+    def handle_request(self, request):
+        lines = request.split(b"\r\n")
+        try:
+            method, target, version = lines[0].split(b" ", 2)
+        except ValueError:
+            self.transport.write(HTTP_BAD_REQUEST)
+            self.transport.close()
+            return
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+
+        path, _, query = target.partition(b"?")
+        if path == b"/events" and method == b"GET":
+            # The connection becomes a Server-Sent Events stream
+            self.streaming = True
+            self.server.subscribe(self.transport, headers.get(b"last-event-id"))
+            return
+
+        self.transport.write(self.server.respond(method, path, query, headers))
+
+        connection = headers.get(b"connection", b"").lower()
+        if connection == b"close" or (version != b"HTTP/1.1" and connection != b"keep-alive"):
+            self.transport.close()
+
+class DashboardServer:
+    def __init__(self, host, port, www_dir):
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.routes = {}
+        for path, (filename, content_type) in HTTP_STATIC_FILES.items():
+            with open(os.path.join(www_dir, filename), 'rb') as f:
+                self.routes[path.encode()] = HTTPResource(f.read(), content_type)
+        self.routes[b"/"] = self.routes[b"/index.html"]
+        self.snapshot = None
+        self.snapshot_event = None
+        # Recent (seq, snapshot) pairs for delta responses and delta
+        # responses already built for the current seq, keyed by client seq
+        self.history = deque(maxlen=DELTA_HISTORY)
+        self.deltas = {}
+        # Transports of connected /events clients, only touched on the server loop
+        self.subscribers = set()
+
+    def start(self):
+        server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: DashboardHTTPProtocol(self), self.host, self.port, reuse_address=True, backlog=1024))
+        self.loop.call_later(SSE_HEARTBEAT, self._heartbeat)
+        threading.Thread(target=self.loop.run_forever, name="http", daemon=True).start()
+        return server
+
+    def publish(self, payload, seq, data):
+        # Called from the collector loop, state is only updated on the server loop
+        self.loop.call_soon_threadsafe(self._publish, payload, seq, data)
+
+    def _publish(self, payload, seq, data):
+        previous = self.history[-1] if self.history else None
+        self.snapshot = HTTPResource(payload, "application/json")
+        self.snapshot_event = sse_event(b"snapshot", seq, payload)
+        self.history.append((seq, data))
+        self.deltas = {}
+        # Subscribers already hold the previous snapshot, so they get a patch
+        # that is serialized once for all of them
+        if previous is not None and previous[0] == seq - 1:
+            patch = serialize_snapshot(merge_patch(previous[1], data))
+            self._broadcast(sse_event(b"patch", seq, patch))
+        else:
+            self._broadcast(self.snapshot_event)
+
+    def find_snapshot(self, seq):
+        # Snapshot with the given seq if it is still in the history
+        if not self.history:
+            return None
+        index = seq - self.history[0][0]
+        if 0 <= index < len(self.history):
+            return self.history[index][1]
+        return None
+
+    def delta(self, since):
+        # Merge patch from the client's seq to the current one, None when the
+        # client is too far behind
+        resource = self.deltas.get(since)
+        if resource is None:
+            base = self.find_snapshot(since)
+            if base is None:
+                return None
+            seq, data = self.history[-1]
+            body = serialize_snapshot({"seq": seq, "since": since, "patch": merge_patch(base, data)})
+            resource = self.deltas[since] = HTTPResource(body, "application/json")
+        return resource
+
+    def subscribe(self, transport, last_event_id=None):
+        transport.write(SSE_HEAD)
+        # A reconnecting EventSource resumes with a patch when possible
+        event = self.snapshot_event
+        if last_event_id is not None and last_event_id.isdigit() and self.history:
+            base = self.find_snapshot(int(last_event_id))
+            if base is not None:
+                seq, data = self.history[-1]
+                event = sse_event(b"patch", seq, serialize_snapshot(merge_patch(base, data)))
+        if event is not None:
+            transport.write(event)
+        self.subscribers.add(transport)
+
+    def _broadcast(self, event):
+        for transport in list(self.subscribers):
+            # Slow clients are dropped instead of buffering snapshots for them
+            if transport.is_closing() or transport.get_write_buffer_size() > SSE_MAX_BUFFER:
+                self.subscribers.discard(transport)
+                transport.close()
+            else:
+                transport.write(event)
+
+    def _heartbeat(self):
+        self._broadcast(SSE_HEARTBEAT_EVENT)
+        self.loop.call_later(SSE_HEARTBEAT, self._heartbeat)
+
+    def respond(self, method, path, query, headers):
+        if method not in (b"GET", b"HEAD"):
+            return HTTP_NOT_ALLOWED
+        if path == b"/data.json":
+            # data.json?since=<seq> answers with a delta when possible
+            resource = self.snapshot
+            match = re.search(rb"(?:^|&)since=(\d+)", query)
+            if match and resource is not None:
+                resource = self.delta(int(match.group(1))) or resource
+        elif path == b"/history":
+            try:
+                body = serialize_snapshot(history_response(query.decode()))
+            except ValueError:
+                return HTTP_BAD_REQUEST
+            resource = HTTPResource(body, "application/json")
+        else:
+            resource = self.routes.get(path)
+        if resource is None:
+            return HTTP_NOT_FOUND
+        return resource.response(method, headers)
+
+# Running built-in server, if enabled
+http_server = None
+# ---------------------
+
+# Digest and sequence number of the last written snapshot
+last_snapshot_digest = None
+# Starts from the wall clock in milliseconds so sequence numbers keep growing
+# across restarts and a client never gets a delta against another run's data
+snapshot_seq = int(time.time() * 1000)
+
+def serialize_snapshot(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+def _write_atomic(path, payload):
+    # Readers (nginx) see either the old or the new file, never a partial one
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+def write_snapshot(data, volatile):
+    # volatile: top-level keys refreshed with every write but ignored when
+    # deciding whether the content changed. Returns the written bytes, or None
+    # when the snapshot is unchanged and nothing was written.
+    global last_snapshot_digest, snapshot_seq
+    digest = hashlib.blake2b(serialize_snapshot(data), digest_size=16).digest()
+    if digest == last_snapshot_digest:
+        return None
+
+    # The system card is refreshed rarely, but the timestamp must follow every write
+    data["system"] = dict(data["system"], last_update=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    # Every changed snapshot gets the next sequence number
+    snapshot_seq += 1
+    data = {"seq": snapshot_seq, **data, **volatile}
+    payload = serialize_snapshot(data)
+    # Save with absolute path to ensure service writes to correct location
+    if DATA_FILE_PATH:
+        _write_atomic(DATA_FILE_PATH, payload)
+        if DATA_FILE_GZIP:
+            _write_atomic(f"{DATA_FILE_PATH}.gz", gzip.compress(payload, mtime=0))
+    if http_server is not None:
+        http_server.publish(payload, snapshot_seq, data)
+    last_snapshot_digest = digest
+    return payload
+
+def run_threaded():
+    executor = ThreadPoolExecutor(max_workers=COLLECTOR_WORKERS, thread_name_prefix="collector")
+    scheduler = TickScheduler(REFRESH_INTERVAL)
+    try:
+        while True:
+            time.sleep(scheduler.delay())
+            tick = scheduler.start()
+            try:
+                data = collect_due(executor, tick, scheduler.publish_deadline())
+                record_history(data)
+                write_snapshot(data, {"scheduler": scheduler.stats()})
+            except Exception as e:
+                print(f"Error in monitor loop: {e}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def run_asyncio():
+    scheduler = TickScheduler(REFRESH_INTERVAL)
     while True:
+        await asyncio.sleep(scheduler.delay())
+        tick = scheduler.start()
         try:
-            data = {
-                "cpu": get_cpu_info(),
-                "memory": get_memory_info(),
-                "disk": get_disk_info(),
-                "mounts": get_mount_info(),
-                "users": get_logged_users(),
-                "services": get_service_status(),
-                "docker_containers": get_docker_containers(),
-                "system": get_system_info(),
-                "ufw": get_ufw_stats(),
-                "fail2ban": get_fail2ban_stats()
-            }
-            
-            # Save with absolute path to ensure service writes to correct location
-            # When running as service in /opt/kkdash, this writes to /opt/kkdash/data.json
-            # Save to configured path
-            with open(DATA_FILE_PATH, 'w') as f:
-                json.dump(data, f, indent=4)
-                
-            
-            time.sleep(REFRESH_INTERVAL)
-        except KeyboardInterrupt:
-            print("\nStopping monitor...")
-            break
+            data = await collect_due_async(tick, scheduler.publish_deadline())
+            record_history(data)
+            write_snapshot(data, {"scheduler": scheduler.stats()})
         except Exception as e:
             print(f"Error in monitor loop: {e}")
-            time.sleep(REFRESH_INTERVAL)
+
+def start_http_server():
+    global http_server
+    try:
+        server = DashboardServer(HTTP_HOST, HTTP_PORT, WWW_DIR)
+        server.start()
+        http_server = server
+        print(f"Serving dashboard on http://{HTTP_HOST}:{HTTP_PORT}")
+    except Exception as e:
+        print(f"Error starting HTTP server: {e}")
+
+def main():
+    print(f"KKDash Monitor started ({ENGINE} engine)...")
+    signal.signal(signal.SIGHUP, reload_host_facts)
+    open_history()
+    if CPU_SAMPLER_HZ:
+        start_cpu_sampler()
+    if HTTP_SERVER:
+        start_http_server()
+    try:
+        if ENGINE == "asyncio":
+            asyncio.run(run_asyncio())
+        else:
+            run_threaded()
+    except KeyboardInterrupt:
+        print("\nStopping monitor...")
 
 if __name__ == "__main__":
     main()